@@ -0,0 +1,543 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import hashlib
+import io
+import os
+import re
+import shutil
+import threading
+import time
+
+from botocore.exceptions import ClientError as BotoClientError
+from jonesy.resources import Resources
+import oracledb
+
+
+DATE = oracledb.DB_TYPE_DATE
+NUMBER = oracledb.DB_TYPE_NUMBER
+TIMESTAMP_TZ = oracledb.DB_TYPE_TIMESTAMP_TZ
+VARCHAR = oracledb.DB_TYPE_VARCHAR
+
+NULL_KEY_PASS_PATTERN = re.compile(r'^\s*AND \S+ IS NULL\b', re.MULTILINE)
+
+AFFILIATIONS = ['STUDENT-TYPE-REGISTERED', 'EMPLOYEE-TYPE-ACADEMIC', 'EMPLOYEE-TYPE-STAFF,STUDENT-TYPE-NOT REGISTERED']
+FIRST_NAMES = ['Ellen', 'Arthur', 'Joan', 'Dallas', 'Samuel', 'Gilbert', 'Jean-Paul', 'Mary', 'Ash', 'Mother']
+LAST_NAMES = ['Ripley', 'Dallas', 'Lambert', 'Kane', 'Brett', 'Parker', 'Ash', 'Hicks', 'Bishop', 'Newt']
+SUBJECTS = ['COMPSCI', 'MATH', 'ENGLISH', 'HISTORY', 'L & S', 'MCELLBI', 'PHYSICS', 'STAT', 'ECON', 'ART']
+
+
+class SyntheticDataset:
+
+    # Rows are computed from their position rather than stored, so that a benchmark of millions of rows measures
+    # Jonesy's memory use and not the fake's. Values are picked from small pools with a multiplicative hash of the
+    # row number, which is cheap and repeatable. The key columns, those a keyset batch seeks on, increase with the
+    # row's position, so that the seek can be a binary search. Per-term datasets have row_count rows for each term
+    # bound to the query, in term order, with the term in term_column.
+    def __init__(self, name, columns, row_count, make_row, key_columns, term_column=None):
+        self.name = name
+        self.description = [(column, db_type, None, None, None, None, True) for column, db_type in columns]
+        self.row_count = row_count
+        self.make_row = make_row
+        self.key_columns = key_columns
+        self.term_column = term_column
+
+    def get_rows(self, sql, params):
+        rows = _Rows(self, params)
+        if 'chunk_count' in params:
+            return self._get_boundaries(rows, params['chunk_count'])
+        elif 'lower_bound' in params or 'upper_bound' in params:
+            start, stop = self._get_range(rows, params)
+        elif 'maximum_row_inclusive' in params:
+            start = params['minimum_row_exclusive']
+            stop = min(params['maximum_row_inclusive'], len(rows))
+        elif 'batch_size' in params:
+            # Synthetic keys are never null, so the final pass of a keyset extract, over null keys, finds no rows.
+            if NULL_KEY_PASS_PATTERN.search(sql):
+                return iter(())
+            start = self._seek(rows, params)
+            stop = min(start + params['batch_size'], len(rows))
+        else:
+            start, stop = 0, len(rows)
+        return (rows[i] for i in range(start, stop))
+
+    # Like NTILE, the first len(rows) % chunk_count groups have one row more than the rest.
+    def _get_boundaries(self, rows, chunk_count):
+        size, remainder = divmod(len(rows), chunk_count)
+        start = 0
+        for chunk in range(min(chunk_count, len(rows))):
+            yield (rows[start][self.key_columns[0]],)
+            start += size + (1 if chunk < remainder else 0)
+
+    def _get_range(self, rows, params):
+        keys = _RowKeys(rows, self.key_columns[:1])
+        start, stop = 0, len(rows)
+        if params.get('lower_bound') is not None:
+            start = bisect_left(keys, (params['lower_bound'],))
+        if params.get('upper_bound') is not None:
+            stop = bisect_left(keys, (params['upper_bound'],))
+        return start, stop
+
+    def _seek(self, rows, params):
+        if 'key_0' not in params:
+            return 0
+        key_columns = self.key_columns
+        if len(rows.terms) > 1 or 'term_0' in params:
+            key_columns = [self.term_column] + key_columns
+        key = tuple(params[f'key_{n}'] for n in range(len(key_columns)))
+        return bisect_right(_RowKeys(rows, key_columns), key)
+
+
+class SyntheticCursor:
+
+    # Stands in for an oracledb cursor. Queries are matched to a dataset by the view they select from, and rows are
+    # handed back arraysize at a time.
+    def __init__(self, datasets, term_ids):
+        self.datasets = datasets
+        self.term_ids = term_ids
+        self.arraysize = 100
+        self.prefetchrows = 2
+        self.description = None
+        self.rows = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __iter__(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+    def execute(self, sql, params=None):
+        params = params or {}
+        if 'CLC_TERMV00_VW' in sql:
+            self.description = [('TERM_ID', VARCHAR, None, None, None, None, True)]
+            self.rows = iter([(term_id,) for term_id in self.term_ids])
+        else:
+            dataset = self.datasets[_get_dataset_name(sql, params)]
+            self.description = dataset.description
+            self.rows = dataset.get_rows(sql, params)
+        return self
+
+    def fetchmany(self, size=None):
+        rows = []
+        for row in self.rows:
+            rows.append(row)
+            if len(rows) >= (size or self.arraysize):
+                break
+        return rows
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+
+class SyntheticPool:
+
+    def __init__(self, datasets, term_ids, session_callback):
+        self.datasets = datasets
+        self.term_ids = term_ids
+        self.session_callback = session_callback
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.sessions == 0:
+                self.session_callback(None, None)
+            self.sessions += 1
+        return _SyntheticConnection(self)
+
+    def close(self, force=False):
+        pass
+
+
+class BenchmarkResources(Resources):
+
+    def __init__(self, config, datasets, term_ids, client):
+        super().__init__(config)
+        self.benchmark_client = client
+        self.datasets = datasets
+        self.term_ids = term_ids
+
+    def get_client(self):
+        with self.lock:
+            if not self.client:
+                self.client = self.benchmark_client
+                self.counts['s3_clients'] += 1
+            return self.client
+
+    def get_pool(self):
+        with self.lock:
+            if not self.pool:
+                self.pool = SyntheticPool(self.datasets, self.term_ids, self._on_new_session)
+            return self.pool
+
+
+class FilesystemS3Client:
+
+    # Implements the few S3 calls that Jonesy makes against a local directory, one subdirectory per bucket. An
+    # optional per-request latency and bandwidth cap give uploads a cost closer to that of the real service.
+    def __init__(self, root, latency=0.0, bandwidth=None):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.upload_count = 0
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._request()
+        shutil.rmtree(self._upload_dir(UploadId), ignore_errors=True)
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._request()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for part in MultipartUpload['Parts']:
+                with open(os.path.join(self._upload_dir(UploadId), str(part['PartNumber'])), 'rb') as part_file:
+                    shutil.copyfileobj(part_file, f)
+        shutil.rmtree(self._upload_dir(UploadId))
+        return {}
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None):
+        self._request()
+        source_path = self._existing_path(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(source_path, path)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._request()
+        with self.lock:
+            self.upload_count += 1
+            upload_id = f'upload-{self.upload_count}'
+        os.makedirs(self._upload_dir(upload_id))
+        return {'UploadId': upload_id}
+
+    def get_object(self, Bucket, Key):
+        self._request()
+        with open(self._existing_path(Bucket, Key, 'GetObject'), 'rb') as f:
+            return {'Body': io.BytesIO(f.read())}
+
+    def head_object(self, Bucket, Key):
+        self._request()
+        return {'ContentLength': os.path.getsize(self._existing_path(Bucket, Key, 'HeadObject'))}
+
+    def list_parts(self, Bucket, Key, UploadId, MaxParts=1000):
+        self._request()
+        if not os.path.isdir(self._upload_dir(UploadId)):
+            raise BotoClientError({'Error': {'Code': 'NoSuchUpload'}}, 'ListParts')
+        return {'Parts': []}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._request(len(Body))
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body)
+        return {}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._request(len(Body))
+        with open(os.path.join(self._upload_dir(UploadId), str(PartNumber)), 'wb') as f:
+            f.write(Body)
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def _existing_path(self, bucket, key, operation):
+        path = self._path(bucket, key)
+        if not os.path.exists(path):
+            raise BotoClientError({'Error': {'Code': 'NoSuchKey'}}, operation)
+        return path
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def _request(self, size=0):
+        with self.lock:
+            self.request_count += 1
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, '.uploads', upload_id)
+
+
+# Volumes are per term where the dataset is per term. Proportions follow a typical term: tens of thousands of
+# sections, a few hundred thousand enrollments, and a campus-wide person table.
+DEFAULT_ROW_COUNTS = {
+    'advisor_notes_access': 2000,
+    'basic_attributes': 600000,
+    'enrollment_updates': 20000,
+    'enrollments': 400000,
+    'instructor_advisor_map': 5000,
+    'instructor_updates': 5000,
+    'term_courses': 40000,
+}
+
+
+def get_datasets(row_counts, decimals=False):
+    row_counts = {**DEFAULT_ROW_COUNTS, **row_counts}
+    number = Decimal if decimals else float
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return {
+        'advisor_notes_access': SyntheticDataset(
+            'advisor_notes_access',
+            [('USER_ID', VARCHAR), ('CS_ID', VARCHAR), ('PERMISSION_LIST', VARCHAR)],
+            row_counts['advisor_notes_access'],
+            lambda i: (str(1000000 + i), str(30000000 + i), _pick(['UC_CS_AA_CURRICULAR_ADVISOR', 'UC_CS_AA_LS'], i)),
+            [0],
+        ),
+        'basic_attributes': SyntheticDataset(
+            'basic_attributes',
+            [
+                ('LDAP_UID', VARCHAR), ('SID', VARCHAR), ('FIRST_NAME', VARCHAR), ('LAST_NAME', VARCHAR),
+                ('EMAIL_ADDRESS', VARCHAR), ('AFFILIATIONS', VARCHAR), ('PERSON_TYPE', VARCHAR),
+                ('ALTERNATEID', VARCHAR),
+            ],
+            row_counts['basic_attributes'],
+            lambda i: (
+                str(10000000 + i),
+                str(3030000000 + i),
+                _pick(FIRST_NAMES, i),
+                _pick(LAST_NAMES, i + 3),
+                f'{_pick(FIRST_NAMES, i).lower()}.{i}@berkeley.edu',
+                _pick(AFFILIATIONS, i),
+                _pick(['S', 'A', 'S', 'U'], i),
+                None if i % 7 else str(2000000 + i),
+            ),
+            [0],
+        ),
+        'enrollment_updates': SyntheticDataset(
+            'enrollment_updates',
+            [
+                ('SECTION_ID', NUMBER), ('TERM_ID', VARCHAR), ('LDAP_UID', VARCHAR), ('SIS_ID', VARCHAR),
+                ('ENROLL_STATUS', VARCHAR), ('COURSE_CAREER', VARCHAR), ('LAST_UPDATED', TIMESTAMP_TZ),
+            ],
+            row_counts['enrollment_updates'],
+            lambda i: (
+                10000 + i // 40,
+                '2248',
+                str(10000000 + i % 40),
+                str(3030000000 + i % 40),
+                _pick(['E', 'W', 'E', 'E'], i),
+                _pick(['UGRD', 'GRAD', 'UGRD', 'LAW'], i),
+                now - timedelta(seconds=_hash(i) % 432000),
+            ),
+            [0],
+            1,
+        ),
+        'enrollments': SyntheticDataset(
+            'enrollments',
+            [
+                ('SECTION_ID', NUMBER), ('TERM_ID', VARCHAR), ('SESSION_ID', VARCHAR), ('LDAP_UID', VARCHAR),
+                ('SIS_ID', VARCHAR), ('ENROLLMENT_STATUS', VARCHAR), ('WAITLIST_POSITION', NUMBER),
+                ('UNITS', NUMBER), ('GRADE', VARCHAR), ('GRADE_POINTS', NUMBER), ('GRADING_BASIS', VARCHAR),
+                ('GRADE_MIDTERM', VARCHAR), ('INSTITUTION', VARCHAR),
+            ],
+            row_counts['enrollments'],
+            lambda i: (
+                10000 + i // 40,
+                '2248',
+                '1',
+                str(10000000 + _hash(i) % 600000),
+                str(3030000000 + i % 40),
+                _pick(['E', 'E', 'E', 'W'], i),
+                None if i % 4 else number(i % 40 + 1),
+                number(_pick([1, 2, 3, 4, 4, 4], i)),
+                _pick(['A', 'A-', 'B+', 'B', 'P', None], i),
+                number(_pick([0, 4, 8, 12, 16], i)),
+                _pick(['GRD', 'PNP', 'GRD', 'NON'], i),
+                None,
+                'UCB01',
+            ),
+            [0, 4],
+            1,
+        ),
+        'instructor_advisor_map': SyntheticDataset(
+            'instructor_advisor_map',
+            [(column, VARCHAR) for column in [
+                'ADVISOR_ID', 'CAMPUS_ID', 'INSTRUCTOR_ADVISOR_NBR', 'ADVISOR_TYPE', 'ADVISOR_TYPE_DESCR',
+                'INSTRUCTOR_TYPE', 'INSTRUCTOR_TYPE_DESCR', 'ACADEMIC_PROGRAM', 'ACADEMIC_PROGRAM_DESCR',
+                'ACADEMIC_PLAN', 'ACADEMIC_PLAN_DESCR', 'ACADEMIC_SUB_PLAN', 'ACADEMIC_SUB_PLAN_DESCR',
+            ]],
+            row_counts['instructor_advisor_map'],
+            lambda i: (
+                str(1000000 + i), str(10000000 + i), str(i % 3 + 1), 'ADVR', 'Advisor', 'ADV', 'Advisor Only',
+                'UCLS', 'Undergrad Letters & Science', f'{_pick(SUBJECTS, i)}U', f'{_pick(SUBJECTS, i)} BA',
+                None, None,
+            ),
+            [0],
+        ),
+        'instructor_updates': SyntheticDataset(
+            'instructor_updates',
+            [
+                ('SIS_ID', VARCHAR), ('TERM_ID', VARCHAR), ('SECTION_ID', NUMBER), ('COURSE_ID', VARCHAR),
+                ('LDAP_UID', VARCHAR), ('ROLE_CODE', VARCHAR), ('primary', VARCHAR), ('LAST_UPDATED', TIMESTAMP_TZ),
+            ],
+            row_counts['instructor_updates'],
+            lambda i: (
+                str(20000000 + i % 3000),
+                '2248',
+                10000 + i,
+                str(100000 + i // 3),
+                str(100000 + i % 3000),
+                _pick(['PI', 'TNIC', 'ICNT', 'APRX'], i),
+                _pick(['true', 'false'], i),
+                now - timedelta(seconds=_hash(i) % 432000),
+            ),
+            [0],
+            1,
+        ),
+        'term_courses': SyntheticDataset(
+            'term_courses',
+            [
+                ('SECTION_ID', VARCHAR), ('TERM_ID', VARCHAR), ('SESSION_ID', VARCHAR), ('DEPT_NAME', VARCHAR),
+                ('DEPT_CODE', VARCHAR), ('COURSE_CAREER_CODE', VARCHAR), ('PRINT_IN_SCHEDULE_OF_CLASSES', VARCHAR),
+                ('PRIMARY', VARCHAR), ('INSTRUCTION_FORMAT', VARCHAR), ('PRIMARY_ASSOCIATED_SECTION_ID', VARCHAR),
+                ('DISPLAY_NAME', VARCHAR), ('SECTION_NUM', VARCHAR), ('COURSE_DISPLAY_NAME', VARCHAR),
+                ('CATALOG_ID', VARCHAR), ('CATALOG_ROOT', VARCHAR), ('CATALOG_PREFIX', VARCHAR),
+                ('CATALOG_SUFFIX', VARCHAR), ('COURSE_UPDATED_DATE', DATE), ('COURSE_ID', VARCHAR),
+                ('ENROLLMENT_COUNT', NUMBER), ('ENROLL_LIMIT', NUMBER), ('WAITLIST_LIMIT', NUMBER),
+                ('START_DATE', DATE), ('END_DATE', DATE), ('INSTRUCTOR_UID', VARCHAR), ('INSTRUCTOR_NAME', VARCHAR),
+                ('INSTRUCTOR_ROLE_CODE', VARCHAR), ('LOCATION', VARCHAR), ('MEETING_DAYS', VARCHAR),
+                ('MEETING_START_TIME', VARCHAR), ('MEETING_END_TIME', VARCHAR), ('MEETING_START_DATE', DATE),
+                ('MEETING_END_DATE', DATE), ('COURSE_TITLE', VARCHAR), ('COURSE_TITLE_SHORT', VARCHAR),
+                ('INSTRUCTION_MODE', VARCHAR),
+            ],
+            row_counts['term_courses'],
+            lambda i: _get_course_row(i, number),
+            [0],
+            1,
+        ),
+    }
+
+
+def _get_course_row(i, number):
+    subject = _pick(SUBJECTS, i // 10)
+    catalog_id = f'{_pick(["", "C", "N", "W"], i)}{i // 10 % 300}{_pick(["", "A", "B", "AC"], i // 10)}'
+    display_name = f'{subject} {catalog_id}'
+    term_start = datetime(2024, 8, 21)
+    term_end = datetime(2024, 12, 20)
+    return (
+        str(10000 + i),
+        '2248',
+        '1',
+        subject,
+        subject,
+        'UGRD',
+        'Y',
+        _pick(['true', 'false', 'false'], i),
+        _pick(['LEC', 'DIS', 'LAB'], i),
+        str(10000 + i - i % 3),
+        display_name,
+        f'{i % 3 + 1:03d}',
+        display_name,
+        catalog_id,
+        str(i // 10 % 300),
+        '',
+        '',
+        datetime(2020, 1, 1) + timedelta(days=i % 1000),
+        str(100000 + i // 10),
+        number(_hash(i) % 300),
+        number(300),
+        number(50),
+        term_start,
+        term_end,
+        str(100000 + i % 3000),
+        f'{_pick(FIRST_NAMES, i)} {_pick(LAST_NAMES, i + 1)}',
+        _pick(['PI', 'TNIC', 'ICNT'], i),
+        f'{_pick(["Dwinelle", "Wheeler", "Evans", "Soda", "Etcheverry"], i)} {100 + i % 200}',
+        _pick(['MOWEFR', 'TUTH', 'MO', 'WE', None], i),
+        _pick(['09:00', '10:00', '14:00', '17:00'], i),
+        _pick(['09:59', '10:59', '15:29', '18:29'], i),
+        term_start,
+        term_end,
+        f'Introduction to {subject.title()} {i // 10 % 300}: Topics in the Study of Things',
+        f'INTRO {subject}',
+        _pick(['P', 'O', 'H'], i),
+    )
+
+
+def _get_dataset_name(sql, params):
+    if 'BOA_ADV_NOTES_ACCESS_VW' in sql:
+        return 'advisor_notes_access'
+    elif 'BOA_INSTRUCTOR_ADVISOR_VW' in sql:
+        return 'instructor_advisor_map'
+    elif 'CALCENTRAL_PERSON_INFO_VW' in sql:
+        return 'basic_attributes'
+    elif 'BCOURSESV00_VW' in sql:
+        return 'term_courses'
+    elif 'CLASS_INSTR_UPDATESV00_VW' in sql:
+        return 'instructor_updates'
+    elif 'ETS_ENROLLMENTV01_VW' in sql and 'recency_cutoff' in params:
+        return 'enrollment_updates'
+    elif 'ETS_ENROLLMENTV01_VW' in sql:
+        return 'enrollments'
+    raise ValueError('No synthetic dataset for query')
+
+
+def _hash(i):
+    return (i * 2654435761) & 0xffffffff
+
+
+def _pick(values, i):
+    return values[_hash(i) % len(values)]
+
+
+class _RowKeys:
+
+    # A read-only sequence view of each row's keyset columns, for bisect.
+    def __init__(self, rows, key_columns):
+        self.rows = rows
+        self.key_columns = key_columns
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        return tuple(row[idx] for idx in self.key_columns)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class _Rows:
+
+    # The rows a query selects from a dataset: those of each term it binds, one term after another.
+    def __init__(self, dataset, params):
+        self.dataset = dataset
+        if dataset.term_column is None:
+            self.terms = [None]
+        elif 'term_id' in params:
+            self.terms = [params['term_id']]
+        else:
+            self.terms = sorted(v for k, v in params.items() if k.startswith('term_'))
+
+    def __getitem__(self, i):
+        row = self.dataset.make_row(i % self.dataset.row_count)
+        term_id = self.terms[i // self.dataset.row_count]
+        if term_id is None:
+            return row
+        return row[:self.dataset.term_column] + (term_id,) + row[self.dataset.term_column + 1:]
+
+    def __len__(self):
+        return self.dataset.row_count * len(self.terms)
+
+
+class _SyntheticConnection:
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def cursor(self):
+        return SyntheticCursor(self.pool.datasets, self.pool.term_ids)
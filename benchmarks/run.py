@@ -0,0 +1,183 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import BenchmarkResources, DEFAULT_ROW_COUNTS, FilesystemS3Client, get_datasets
+from dotenv import dotenv_values
+from jonesy import jobs
+
+
+# Only settings that bear on throughput are stored with results, and are compared when looking for a previous run.
+PERFORMANCE_SETTINGS = (
+    'BATCH_',
+    'CHUNK',
+    'COMPRESSION_',
+    'JOB_PARALLELISM',
+    'MULTI_TERM_QUERIES',
+    'PARQUET_',
+    'PIPELINE_',
+    'QUERY_CACHE',
+    'RECENT_REFRESH_MODE',
+    'S3_',
+    'SISEDO_ARRAYSIZE',
+    'SISEDO_PREFETCHROWS',
+)
+TERM_IDS = ['2248', '2252', '2255', '2258']
+
+
+def main():
+    args = _parse_args()
+    row_counts = {name: int(count * args.scale) for name, count in DEFAULT_ROW_COUNTS.items()}
+    for setting in args.rows:
+        name, count = setting.split('=')
+        row_counts[name] = int(count)
+    sink = tempfile.mkdtemp(prefix='jonesy-benchmark-')
+    config = {
+        **dotenv_values('.env.shared'),
+        **dict(setting.split('=', 1) for setting in args.set),
+        'AWS_ROLE_ARN': '',
+        'CHECKPOINT_DIR': os.path.join(sink, 'checkpoints'),
+        'METRICS_PATH': '',
+        'METRICS_TEXTFILE_DIR': '',
+        'QUERY_CACHE_DIR': os.path.join(sink, 'query-cache'),
+        'TARGETS': ','.join(f'benchmark-{n}' for n in range(args.targets)),
+        'WATERMARK_PATH': os.path.join(sink, 'watermarks.json'),
+        'WATERMARK_STORE': 'local',
+    }
+    jobs.BATCH_SIZE = args.batch_size
+    client = FilesystemS3Client(
+        sink,
+        latency=args.s3_latency_ms / 1000,
+        bandwidth=args.s3_bandwidth_mbps * 1024 * 1024 / 8 if args.s3_bandwidth_mbps else None,
+    )
+    resources = BenchmarkResources(config, get_datasets(row_counts, args.decimals), TERM_IDS[:args.terms], client)
+    job = jobs.Job(args.job, config, resources)
+    started_at = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+    try:
+        success = job.run()
+    finally:
+        seconds = time.perf_counter() - start_time
+        if not args.keep:
+            shutil.rmtree(sink, ignore_errors=True)
+
+    extracts = [e.to_record() for e in job.metrics.extracts]
+    rows = sum(e.get('rows', 0) for e in extracts)
+    raw_bytes = sum(e.get('raw_bytes', 0) for e in extracts)
+    compressed_bytes = sum(e.get('compressed_bytes', 0) for e in extracts)
+    stages = {}
+    for extract in extracts:
+        for stage, stage_seconds in extract['stages'].items():
+            stages[stage] = round(stages.get(stage, 0) + stage_seconds, 3)
+    result = {
+        'type': 'benchmark',
+        'label': args.label,
+        'started_at': started_at.isoformat(),
+        'commit': _get_commit(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'job': args.job,
+        'parameters': {
+            'batch_size': args.batch_size,
+            'decimals': args.decimals,
+            'row_counts': row_counts,
+            's3_bandwidth_mbps': args.s3_bandwidth_mbps,
+            's3_latency_ms': args.s3_latency_ms,
+            'targets': args.targets,
+            'terms': args.terms,
+        },
+        'settings': {k: v for k, v in sorted(config.items()) if k.startswith(PERFORMANCE_SETTINGS)},
+        'success': success,
+        'seconds': round(seconds, 3),
+        'rows': rows,
+        'rows_per_sec': round(rows / seconds, 1),
+        'raw_bytes': raw_bytes,
+        'compressed_bytes': compressed_bytes,
+        'raw_mb_per_sec': round(raw_bytes / seconds / 1024 / 1024, 2),
+        'compressed_mb_per_sec': round(compressed_bytes / seconds / 1024 / 1024, 2),
+        'peak_rss_mb': round(_get_peak_rss() / 1024 / 1024, 1),
+        's3_requests': client.request_count,
+        'stages': stages,
+        'extracts': extracts,
+    }
+    previous = _get_previous_result(args.output, result)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    _print_result(result, previous)
+    return success
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _get_peak_rss():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+# The most recent result of the same job, volumes and settings is the baseline for comparison.
+def _get_previous_result(path, result):
+    if not path or not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if all(record.get(k) == result[k] for k in ('job', 'parameters', 'settings')):
+                previous = record
+    return previous
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Run a Jonesy job end to end against synthetic SISEDO data.')
+    parser.add_argument('--job', default='upload_snapshot')
+    parser.add_argument('--batch-size', type=int, default=jobs.BATCH_SIZE)
+    parser.add_argument('--decimals', action='store_true', help='fetch numbers as Decimal rather than float')
+    parser.add_argument('--keep', action='store_true', help='keep the uploaded files')
+    parser.add_argument('--label', help='note stored with the result')
+    parser.add_argument('--output', default='log/benchmarks.jsonl', help='results file, appended to')
+    parser.add_argument('--rows', action='append', default=[], metavar='DATASET=COUNT', help='rows in a dataset')
+    parser.add_argument('--s3-bandwidth-mbps', type=float, default=0, help='simulated upload bandwidth')
+    parser.add_argument('--s3-latency-ms', type=float, default=0, help='simulated latency per S3 request')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier on the default row counts')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='override a setting')
+    parser.add_argument('--targets', type=int, default=2, help='number of target buckets')
+    parser.add_argument('--terms', type=int, default=3, choices=range(1, len(TERM_IDS) + 1))
+    return parser.parse_args()
+
+
+def _print_result(result, previous):
+    print()
+    print(f"Benchmark {result['job']}: success={result['success']}, commit={result['commit']}")
+    for field in ('seconds', 'rows_per_sec', 'raw_mb_per_sec', 'compressed_mb_per_sec', 'peak_rss_mb'):
+        line = f'  {field}: {result[field]}'
+        if previous and previous.get(field):
+            change = (result[field] - previous[field]) / previous[field] * 100
+            line += f" (previous {previous[field]} at {previous['commit']}, {change:+.1f}%)"
+        print(line)
+    stages = ', '.join(f'{stage}={seconds}' for stage, seconds in result['stages'].items())
+    print(f'  stage seconds: {stages}')
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
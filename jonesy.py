@@ -1,7 +1,9 @@
 import os
+import sys
 
 from dotenv import dotenv_values
 from jonesy.jobs import Job
+from jonesy.scheduler import Scheduler
 
 
 config = {
@@ -12,5 +14,7 @@ config = {
 
 if 'JOB' not in os.environ:
     print('No job specified, aborting')
+elif os.environ['JOB'] == 'scheduler':
+    sys.exit(0 if Scheduler(config).run() else 1)
 else:
-    Job(os.environ['JOB'], config).run()
+    sys.exit(0 if Job(os.environ['JOB'], config).run() else 1)
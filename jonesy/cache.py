@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class QueryCache:
+
+    # Results of SISEDO queries, kept on local disk so that reruns and other jobs within ttl seconds can use them
+    # without querying again. Entries are keyed by a digest of the SQL, with whitespace normalized, and its bind
+    # parameters. Small results, such as the current term ids, are kept as JSON rows; extract results as the CSV
+    # written for them, compressed. Once the cache holds more than max_bytes, the least recently used entries are
+    # removed. Since the directory may be shared between processes, entries are written to a temporary file and
+    # renamed into place.
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_rows(self, query):
+        path = self._get_path(query, '.json')
+        metadata = self._get_fresh_metadata(path, path)
+        return metadata['rows'] if metadata else None
+
+    # Returns a text file of the cached CSV and its row count, or None.
+    def open(self, query):
+        path = self._get_path(query, '.csv.gz')
+        metadata = self._get_fresh_metadata(f'{path}.json', path)
+        if not metadata:
+            return None
+        try:
+            return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline=''), metadata['rows']
+        except OSError:
+            return None
+
+    def put_rows(self, query, rows):
+        path = self._get_path(query, '.json')
+        self._replace(path, _get_metadata(rows))
+        self._evict()
+
+    # Yields a CacheEntry to write CSV text to. The entry is added to the cache only if the block completes.
+    @contextmanager
+    def writer(self, query):
+        path = self._get_path(query, '.csv.gz')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        entry = CacheEntry(os.fdopen(fd, 'wb'))
+        try:
+            yield entry
+            entry.close()
+            os.replace(tmp_path, path)
+            self._replace(f'{path}.json', _get_metadata(entry.row_count))
+        except BaseException:
+            entry.close()
+            os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            entries = []
+            total_bytes = 0
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total_bytes += stat.st_size
+            for mtime, size, name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+    # An entry's age is kept in its metadata, so that reading it, which counts as use for eviction, doesn't renew it.
+    def _get_fresh_metadata(self, metadata_path, path):
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+            if time.time() - metadata['created_at'] > self.ttl:
+                return None
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return metadata
+
+    def _get_path(self, query, extension):
+        sql, params = query
+        normalized = json.dumps([' '.join(sql.split()), params], sort_keys=True, default=str)
+        return os.path.join(self.directory, hashlib.sha256(normalized.encode()).hexdigest() + extension)
+
+    def _replace(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class CacheEntry:
+
+    # Compresses CSV text into a cache file as it is written, at a low level, since the cache is read back once or
+    # twice at most.
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.gzip = gzip.GzipFile(mode='wb', fileobj=fileobj, compresslevel=1)
+        self.row_count = 0
+
+    def close(self):
+        if not self.gzip.closed:
+            self.gzip.close()
+            self.fileobj.close()
+
+    def write(self, text):
+        self.gzip.write(text.encode('utf-8'))
+
+
+def _get_metadata(rows):
+    return json.dumps({'created_at': time.time(), 'rows': rows}).encode()
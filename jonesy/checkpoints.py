@@ -0,0 +1,67 @@
+from datetime import datetime
+from decimal import Decimal
+import hashlib
+import json
+import os
+
+from jonesy.files import replace_file
+
+
+class Checkpoint:
+
+    # Progress of one batched extract: the batch cursor to resume from, the S3 multipart upload holding every batch
+    # before it, and running totals. The file is named for the S3 key, which includes the daily path, so a rerun only
+    # resumes an extract begun the same day.
+    def __init__(self, checkpoint_dir, s3_key):
+        self.s3_key = s3_key
+        self.path = os.path.join(checkpoint_dir, hashlib.sha1(s3_key.encode()).hexdigest() + '.json')
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('key') != self.s3_key:
+            return None
+        state['last_row'] = _decode_row(state['last_row'])
+        state.setdefault('null_keys', False)
+        return state
+
+    def save(self, state):
+        state = {**state, 'key': self.s3_key, 'last_row': _encode_row(state['last_row'])}
+        replace_file(self.path, json.dumps(state))
+
+
+# Rows are kept with their Oracle-native types, since keyset batches bind the last row's key values as they came.
+def _decode_row(row):
+    if row is None:
+        return None
+    return tuple(_decode_value(v) for v in row)
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'datetime' in value:
+            return datetime.fromisoformat(value['datetime'])
+        if 'decimal' in value:
+            return Decimal(value['decimal'])
+    return value
+
+
+def _encode_row(row):
+    if row is None:
+        return None
+    return [_encode_value(v) for v in row]
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'decimal': str(value)}
+    return value
@@ -0,0 +1,164 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import io
+import os
+
+from jonesy.metrics import timed
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CompressionWriter(io.BufferedIOBase):
+
+    # Wraps a codec's compressing stream so that the size and digest of the uncompressed content can be reported
+    # alongside the compressed size. Closing the writer finishes the compressed stream but leaves the underlying file
+    # object open.
+    def __init__(self, compressor, metrics=None):
+        super().__init__()
+        self.compressor = compressor
+        self.metrics = metrics
+        self.raw_size = 0
+        self.sha256 = hashlib.sha256()
+
+    def close(self):
+        if not self.closed:
+            with timed(self.metrics, 'compress'):
+                self.compressor.close()
+            super().close()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        with timed(self.metrics, 'compress'):
+            self.raw_size += len(data)
+            self.sha256.update(data)
+            self.compressor.write(data)
+        return len(data)
+
+
+class ParallelGzipWriter(io.BufferedIOBase):
+
+    # Input is cut into fixed-size blocks, and each block is compressed into a complete gzip member on a worker thread
+    # while the next block fills. Members are written out in order; concatenated gzip members form a standard .gz
+    # stream that gzip, zcat and Redshift COPY all read as a single file. At most two blocks per thread are queued.
+    def __init__(self, fileobj, level, threads, block_size, metrics=None):
+        super().__init__()
+        self.fileobj = fileobj
+        self.metrics = metrics
+        self.level = level
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='gzip')
+        self.max_pending_blocks = threads * 2
+        self.pending_blocks = deque()
+        self.raw_size = 0
+        self.sha256 = hashlib.sha256()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            with timed(self.metrics, 'compress'):
+                if self.buffer or not self.raw_size:
+                    self._submit_block(bytes(self.buffer))
+                    self.buffer = bytearray()
+                while self.pending_blocks:
+                    self.fileobj.write(self.pending_blocks.popleft().result())
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            super().close()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        with timed(self.metrics, 'compress'):
+            self.raw_size += len(data)
+            self.sha256.update(data)
+            self.buffer += data
+            while len(self.buffer) >= self.block_size:
+                block = bytes(self.buffer[:self.block_size])
+                del self.buffer[:self.block_size]
+                self._submit_block(block)
+        return len(data)
+
+    def _submit_block(self, block):
+        while len(self.pending_blocks) >= self.max_pending_blocks:
+            self.fileobj.write(self.pending_blocks.popleft().result())
+        self.pending_blocks.append(self.executor.submit(gzip.compress, block, compresslevel=self.level, mtime=0))
+
+
+class GzipCodec:
+
+    extension = '.gz'
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def open(self, fileobj, metrics=None):
+        return CompressionWriter(gzip.GzipFile(mode='wb', fileobj=fileobj, compresslevel=self.level), metrics)
+
+
+class ParallelGzipCodec:
+
+    extension = '.gz'
+    name = 'pgzip'
+
+    def __init__(self, level, threads, block_size):
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+
+    def open(self, fileobj, metrics=None):
+        return ParallelGzipWriter(fileobj, self.level, self.threads, self.block_size, metrics)
+
+
+class ZstdCodec:
+
+    extension = '.zst'
+    name = 'zstd'
+
+    def __init__(self, level, threads):
+        self.level = level
+        self.threads = threads
+
+    def open(self, fileobj, metrics=None):
+        compressor = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+        return CompressionWriter(compressor.stream_writer(fileobj, closefd=False), metrics)
+
+
+def get_codec(config):
+    name = config.get('COMPRESSION_CODEC', 'gzip')
+    level = config.get('COMPRESSION_LEVEL')
+    threads = int(config.get('COMPRESSION_THREADS') or os.cpu_count() or 1)
+    if name == 'gzip':
+        return GzipCodec(int(level or 9))
+    elif name == 'pgzip':
+        block_size = int(config.get('COMPRESSION_BLOCK_SIZE_MB', 1)) * 1024 * 1024
+        return ParallelGzipCodec(int(level or 9), threads, block_size)
+    elif name == 'zstd':
+        if not zstandard:
+            raise ValueError('COMPRESSION_CODEC is zstd, but the zstandard package is not installed')
+        return ZstdCodec(int(level or 3), threads)
+    else:
+        raise ValueError(f'Unknown COMPRESSION_CODEC: {name}')
+
+
+# Reads back an object written by any codec, which is known by the key's extension. Gzip readers take the
+# concatenated members written by parallel gzip, and zstd readers the concatenated frames.
+def open_decompressed(fileobj, key):
+    if key.endswith('.gz'):
+        return gzip.GzipFile(mode='rb', fileobj=fileobj)
+    elif key.endswith('.zst'):
+        if not zstandard:
+            raise ValueError(f'Cannot read {key}: the zstandard package is not installed')
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    else:
+        raise ValueError(f'Unknown compression for {key}')
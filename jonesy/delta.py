@@ -0,0 +1,165 @@
+from collections import Counter
+import csv
+from decimal import InvalidOperation
+import io
+import os
+import threading
+
+
+class DeltaError(Exception):
+    pass
+
+
+class DeltaFeed:
+
+    # Passes the CSV text of an extract, as it is written, through a pipe to compute_delta, which is called with the
+    # extract's rows on a thread of its own. The delta is then worked out alongside the extract rather than from a
+    # second download of it once uploaded. The pipe's buffer bounds memory use, so a delta that falls behind holds the
+    # extract back. If the delta stops reading, as when it fails, the extract carries on without it. The rows only end
+    # once finish() is called, and unless the extract was uploaded in full they end with a DeltaError, so that
+    # compute_delta discards what it has written.
+    def __init__(self, compute_delta, name='delta'):
+        self.compute_delta = compute_delta
+        self.name = name
+        self.complete = False
+        self.pipe = None
+        self.result = False
+        self.thread = None
+
+    def finish(self, complete):
+        self.complete = complete
+        self._close_pipe()
+        if self.thread:
+            self.thread.join()
+        return self.result
+
+    @property
+    def started(self):
+        return self.thread is not None
+
+    # Starts the delta on first use, and returns fileobj wrapped so that bytes written to it are fed to the delta too.
+    def tee(self, fileobj):
+        if not self.thread:
+            read_fd, write_fd = os.pipe()
+            self.pipe = open(write_fd, 'wb')
+            self.thread = threading.Thread(target=self._run, args=(read_fd,), name=self.name, daemon=True)
+            self.thread.start()
+        return _TeeWriter(fileobj, self)
+
+    def write(self, data):
+        if self.pipe:
+            try:
+                self.pipe.write(data)
+            except BrokenPipeError:
+                self._close_pipe()
+
+    def _close_pipe(self):
+        if self.pipe:
+            try:
+                self.pipe.close()
+            except BrokenPipeError:
+                pass
+            self.pipe = None
+
+    def _read_rows(self, infile):
+        yield from csv.reader(infile)
+        if not self.complete:
+            raise DeltaError('Extract was not uploaded in full')
+
+    def _run(self, read_fd):
+        with open(read_fd, 'r', encoding='utf-8', newline='') as infile:
+            self.result = self.compute_delta(self._read_rows(infile))
+
+
+class _TeeWriter(io.BufferedIOBase):
+
+    # Closing the writer closes fileobj but leaves the feed open, since one extract may be written through several.
+    def __init__(self, fileobj, feed):
+        super().__init__()
+        self.fileobj = fileobj
+        self.feed = feed
+
+    def close(self):
+        if not self.closed:
+            self.fileobj.close()
+            super().close()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.feed.write(data)
+        return self.fileobj.write(data)
+
+
+# Compares two CSV extracts sorted on the same key columns, a list of (index, type) pairs where type is Decimal for
+# NUMBER columns and str for the rest, and yields ('added', row), ('changed', row) and ('removed', row) for the rows
+# that differ. Both extracts are read once, in step, so memory use does not grow with their size. Keys compare as
+# Oracle orders them: by value within their type, with nulls (empty values) last. A row whose key sorts before the
+# previous row's means the extract is not in the order expected, and raises DeltaError rather than producing a wrong
+# delta. Where a key has one row on each side, a difference is a change; where it has several, rows found on only
+# one side are added or removed.
+def diff_sorted_rows(previous_rows, rows, key_columns):
+    previous_groups = _group_rows(previous_rows, key_columns)
+    groups = _group_rows(rows, key_columns)
+    previous_group = next(previous_groups, None)
+    group = next(groups, None)
+    while previous_group or group:
+        if group is None or (previous_group and previous_group[0] < group[0]):
+            for row in previous_group[1]:
+                yield 'removed', row
+            previous_group = next(previous_groups, None)
+        elif previous_group is None or group[0] < previous_group[0]:
+            for row in group[1]:
+                yield 'added', row
+            group = next(groups, None)
+        else:
+            yield from _diff_group(previous_group[1], group[1])
+            previous_group = next(previous_groups, None)
+            group = next(groups, None)
+
+
+def _diff_group(previous_rows, rows):
+    if previous_rows == rows:
+        return
+    if len(previous_rows) == 1 and len(rows) == 1:
+        yield 'changed', rows[0]
+        return
+    previous_counts = Counter(tuple(r) for r in previous_rows)
+    counts = Counter(tuple(r) for r in rows)
+    for row in (previous_counts - counts).elements():
+        yield 'removed', list(row)
+    for row in (counts - previous_counts).elements():
+        yield 'added', list(row)
+
+
+def _get_sort_key(row, key_columns):
+    key = []
+    for idx, column_type in key_columns:
+        value = row[idx]
+        if value == '':
+            key.append((1, ''))
+        else:
+            try:
+                key.append((0, column_type(value)))
+            except InvalidOperation:
+                raise DeltaError(f'Key column {idx} value {value!r} is not a {column_type.__name__}')
+    return tuple(key)
+
+
+def _group_rows(rows, key_columns):
+    group_key = None
+    group = []
+    for row in rows:
+        key = _get_sort_key(row, key_columns)
+        if group and key == group_key:
+            group.append(row)
+            continue
+        if group:
+            if key < group_key:
+                raise DeltaError(f'Rows out of key order: {key} follows {group_key}')
+            yield group_key, group
+        group_key = key
+        group = [row]
+    if group:
+        yield group_key, group
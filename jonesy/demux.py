@@ -0,0 +1,35 @@
+class TermDemultiplexer:
+
+    # Splits the fetched batches of a multi-term query, whose rows come ordered by term, into a run of batches per
+    # term. Terms are read one after another, in order, with batches_for(). Rows left over from an earlier term, for
+    # instance because its upload failed partway, are skipped.
+    def __init__(self, batches, description):
+        self.batches = iter(batches)
+        self.pending = []
+        self.term_idx = [c[0].lower() for c in description].index('term_id')
+
+    def batches_for(self, term_id):
+        term_id = str(term_id)
+        while True:
+            if not self.pending:
+                self.pending = next(self.batches, None)
+                if not self.pending:
+                    return
+            rows = self.pending
+            if str(rows[0][self.term_idx]) < term_id:
+                self.pending = self._drop_term(rows, str(rows[0][self.term_idx]))
+                continue
+            if str(rows[0][self.term_idx]) > term_id:
+                return
+            if str(rows[-1][self.term_idx]) == term_id:
+                self.pending = []
+                yield rows
+            else:
+                end = 0
+                while str(rows[end][self.term_idx]) == term_id:
+                    end += 1
+                self.pending = rows[end:]
+                yield rows[:end]
+
+    def _drop_term(self, rows, term_id):
+        return [r for r in rows if str(r[self.term_idx]) != term_id]
@@ -0,0 +1,9 @@
+import os
+
+
+# Readers such as monitoring, the metrics collector or a rerun may open the file at any moment, so text is written to
+# a temporary file beside it and swapped into place whole.
+def replace_file(path, text):
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(text)
+    os.replace(f'{path}.tmp', path)
@@ -1,184 +1,1067 @@
-from contextlib import contextmanager
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack, nullcontext
 import csv
-from datetime import datetime
-import gzip
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import partial
 import hashlib
 import io
 import os
+import re
+import shutil
 import tempfile
+import threading
 import time
+import traceback
 
-import boto3
 from botocore.exceptions import ClientError as BotoClientError, ConnectionError as BotoConnectionError
 from jonesy import queries
-import oracledb
+from jonesy.cache import QueryCache
+from jonesy.checkpoints import Checkpoint
+from jonesy.compression import get_codec, open_decompressed
+from jonesy.delta import DeltaError, DeltaFeed, diff_sorted_rows
+from jonesy.demux import TermDemultiplexer
+from jonesy.metrics import RunMetrics, timed
+from jonesy.parquet import DATETIME_TYPES, ParquetWriter
+from jonesy.pipeline import Pipeline
+from jonesy.resources import Resources
+from jonesy.sharding import ShardedWriter
+from jonesy.storage import (
+    copy_object,
+    DAILY_PATH_PATTERN,
+    get_manifest,
+    get_manifest_key,
+    get_object_size,
+    multipart_upload_exists,
+    put_manifest,
+    S3UploadError,
+    S3UploadStream,
+)
+from jonesy.watermarks import WatermarkStore
 import pytz
 
 
 BATCH_SIZE = 120000
+# Delta extracts identify rows by these CSV columns, as (index, type), in the order that the extract is sorted.
+BASIC_ATTRIBUTES_DELTA_KEY = [(0, str)]
+DELTA_KINDS = ['added', 'changed', 'removed']
+ENROLLMENTS_DELTA_KEY = [(0, Decimal), (4, str)]
+LOCAL_TIMEZONE = pytz.timezone('America/Los_Angeles')
 RECENT_REFRESH_CUTOFF_DAYS = 5
+# Incremental extracts carry a run time in their keys, which would otherwise make a new metrics series on every run.
+RUN_TIME_PATTERN = re.compile(r'-\d{6}$')
 
 
 class Job:
 
-    def __init__(self, name, config):
+    def __init__(self, name, config, resources=None):
         self.name = name
         self.config = config
+        self.owns_resources = resources is None
+        self.resources = resources or Resources(config)
+        self.metrics = RunMetrics(name)
+        # Deltas to be fed the rows of the extract with each key, as it is written.
+        self.delta_feeds = {}
+        self.parquet_datasets = [d.strip() for d in config.get('PARQUET_DATASETS', '').split(',') if d.strip()]
+        self.pipeline_queue_size = int(config.get('PIPELINE_QUEUE_SIZE', 4))
+        self.query_cache = None
+        if config.get('QUERY_CACHE', 'false') == 'true':
+            self.query_cache = QueryCache(
+                config.get('QUERY_CACHE_DIR', 'log/query-cache'),
+                int(config.get('QUERY_CACHE_TTL_MINUTES', 60)) * 60,
+                int(config.get('QUERY_CACHE_MAX_MB', 512)) * 1024 * 1024,
+            )
+        # Recent refresh extracts are bound to the current time, so their results could never be reused and would only
+        # push other entries out of the cache. That job still caches the current term ids.
+        self.extract_cache = None if name == 'upload_recent_refresh' else self.query_cache
+        # Window-mode recent refresh rewrites the same keys through the day, so that job never skips an extract.
+        self.skip_uploaded = config.get('SKIP_UPLOADED_EXTRACTS', 'false') == 'true' and name != 'upload_recent_refresh'
 
     def run(self):
-        daily_path = get_daily_path()
-        if self.name == 'upload_advisors':
-            self.upload_query_results(
-                queries.get_advisor_notes_access(),
-                f'sis-data/sis-sysadm/{daily_path}/advisors/advisor-note-permissions/advisor-note-permissions.gz',
+        success = False
+        counts_at_start = self.resources.get_counts()
+        try:
+            tasks = self._get_tasks()
+            if tasks is None:
+                print(f"Job {self.name} not found, aborting")
+                return False
+            success = self.run_tasks(tasks)
+            return success
+        finally:
+            self.metrics.write(self.config, success)
+            self.resources.log_counts(self.name, counts_at_start)
+            if self.owns_resources:
+                self.resources.close()
+
+    def get_buckets(self, targets=None):
+        if not targets:
+            if 'TARGETS' in self.config:
+                targets = self.config['TARGETS']
+            else:
+                print('No S3 targets specified, aborting')
+                exit()
+        return targets.split(',')
+
+    def get_client(self):
+        return self.resources.get_client()
+
+    def get_current_term_ids(self):
+        query = queries.get_current_terms()
+        rows = self.query_cache.get_rows(query) if self.query_cache else None
+        if rows is None:
+            with self.resources.sisedo_connection() as sisedo:
+                sql, params = query
+                rows = [list(r) for r in sisedo.execute(sql, params)]
+            if self.query_cache:
+                self.query_cache.put_rows(query, rows)
+        term_ids = [r[0] for r in rows]
+        return term_ids
+
+    # Extracts within a job are independent of one another, and run on up to JOB_PARALLELISM worker threads over the
+    # shared connection pool. The job fails if any extract fails.
+    def run_tasks(self, tasks):
+        parallelism = int(self.config.get('JOB_PARALLELISM', 1))
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix=self.name) as executor:
+            futures = [executor.submit(task) for task in tasks]
+        failure_count = 0
+        for task, future in zip(tasks, futures):
+            try:
+                success = future.result()
+            except Exception as e:
+                traceback.print_exception(e)
+                success = False
+            if not success:
+                print(f'Error in job {self.name}: task failed, key={task.args[1]}')
+                failure_count += 1
+        print(f'Job {self.name} complete: {len(tasks) - failure_count} of {len(tasks)} tasks succeeded')
+        return failure_count == 0
+
+    def upload_batched_query_results(self, batch_query, s3_key, targets=None):
+        if self._is_uploaded(s3_key, targets):
+            return True
+        resumable = not any(self._get_shard_limits()) and _get_dataset_folder(s3_key) not in self.parquet_datasets
+        if self.config.get('BATCH_CHECKPOINTS', 'true') == 'true' and resumable:
+            return self.upload_resumable_batched_query_results(batch_query, s3_key, targets, check_uploaded=False)
+
+        def _write_batches(outfile, metrics, parquet=None):
+            with self.resources.sisedo_connection() as sisedo:
+                batch = 0
+                last_row = None
+                null_keys = False
+                total_row_count = 0
+                while True:
+                    batch_start_time = time.perf_counter()
+                    stages_at_start = metrics.get_stages()
+                    query = batch_query(batch, BATCH_SIZE, last_row, null_keys)
+                    if query is None:
+                        break
+                    row_count, last_row, max_value = _write_csv_rows(
+                        sisedo, query, outfile, metrics=metrics, queue_size=self.pipeline_queue_size, parquet=parquet,
+                    )
+                    metrics.record_batch(batch, row_count, time.perf_counter() - batch_start_time, stages_at_start)
+                    total_row_count += row_count
+                    batch += 1
+                    # If we receive fewer rows than the batch size, we've read all available rows in this pass. Keyset
+                    # batches go on to a final pass over rows with a null leading key.
+                    if row_count < BATCH_SIZE:
+                        if null_keys:
+                            break
+                        last_row = None
+                        null_keys = True
+            return total_row_count
+
+        return self.upload_stream(_write_batches, s3_key, targets, check_uploaded=False)
+
+    # A chunked query is a pair of query builders: one for the boundaries of CHUNK_COUNT key ranges, and one for the
+    # rows within a range. Ranges are fetched concurrently, up to CHUNK_PARALLELISM at a time, each on its own pooled
+    # connection and spooled as CSV to a temporary file. Spooled chunks are written to the upload stream in key order,
+    # so the result is the same file a single query would produce. A range is only started once the range
+    # CHUNK_PARALLELISM before it has been written, so that no more than that many chunks are spooled at once.
+    def upload_chunked_query_results(self, chunked_query, s3_key, targets=None):
+        if self._is_uploaded(s3_key, targets):
+            return True
+        get_boundaries_query, get_chunk_query = chunked_query
+        chunk_count = int(self.config.get('CHUNK_COUNT', 8))
+        with self.resources.sisedo_connection() as sisedo:
+            sql, params = get_boundaries_query(chunk_count)
+            boundaries = []
+            for row in sisedo.execute(sql, params):
+                if not boundaries or row[0] != boundaries[-1]:
+                    boundaries.append(row[0])
+        # The first boundary is the least key, which the first range takes without a lower bound.
+        bounds = [None] + boundaries[1:] + [None]
+        chunk_queries = [get_chunk_query(lower, upper) for lower, upper in zip(bounds[:-1], bounds[1:])]
+
+        def _write_chunks(outfile, metrics, parquet=None):
+            cancelled = threading.Event()
+            parallelism = int(self.config.get('CHUNK_PARALLELISM', 4))
+            executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='extract-chunk')
+            futures = []
+
+            def _submit_next_chunk():
+                if len(futures) < len(chunk_queries):
+                    futures.append(executor.submit(self._spool_chunk, chunk_queries[len(futures)], metrics, cancelled))
+
+            total_row_count = 0
+            try:
+                for _ in range(parallelism):
+                    _submit_next_chunk()
+                for chunk in range(len(chunk_queries)):
+                    chunk_start_time = time.perf_counter()
+                    stages_at_start = metrics.get_stages()
+                    spool, row_count, seconds, chunk_metrics = futures[chunk].result()
+                    with spool:
+                        shutil.copyfileobj(spool, outfile, 1024 * 1024)
+                    _submit_next_chunk()
+                    # Sharded output may only be cut between chunks, where the row count is known.
+                    if isinstance(outfile, ShardedWriter):
+                        outfile.end_batch(row_count)
+                    metrics.merge(chunk_metrics)
+                    seconds += time.perf_counter() - chunk_start_time
+                    metrics.record_batch(chunk, row_count, seconds, stages_at_start)
+                    total_row_count += row_count
+            finally:
+                cancelled.set()
+                executor.shutdown(wait=True, cancel_futures=True)
+                for future in futures:
+                    if future.done() and not future.cancelled() and not future.exception():
+                        future.result()[0].close()
+            return total_row_count
+
+        return self.upload_stream(_write_chunks, s3_key, targets, parquet=False, check_uploaded=False)
+
+    # The delta of an extract against the same dataset's upload from the most recent earlier day, within
+    # DELTA_LOOKBACK_DAYS, is written as added, changed and removed row files under a sibling '-delta' prefix. For
+    # example, enrollments/enrollments-2248.gz gets enrollments-delta/enrollments-2248-added.gz and so on, with the
+    # counts in enrollments-delta/enrollments-2248.json. Changed rows are written as they are now, removed rows as
+    # they were. The previous extract is streamed back from the first target, as is today's unless its rows are passed
+    # in, so memory use does not grow with their size.
+    def upload_delta(self, s3_key, key_columns, rows=None, targets=None):
+        buckets = self.get_buckets(targets)
+        client = self.get_client()
+        codec = get_codec(self.config)
+        s3_key = _get_codec_key(s3_key, codec)
+        previous_key = self._get_previous_daily_key(client, buckets[0], s3_key)
+        if not previous_key:
+            print(f'Delta skipped, no previous upload: key={s3_key}')
+            return True
+        start_time = time.perf_counter()
+        delta_keys = {kind: _get_delta_key(s3_key, f'-{kind}{codec.extension}') for kind in DELTA_KINDS}
+        counts = {kind: 0 for kind in DELTA_KINDS}
+        try:
+            with ExitStack() as stack:
+                writers = {}
+                for kind, delta_key in delta_keys.items():
+                    stream = stack.enter_context(self._open_upload_stream(client, buckets[0], delta_key))
+                    outfile = stack.enter_context(
+                        io.TextIOWrapper(codec.open(stream), encoding='utf-8', newline='\n'),
+                    )
+                    writers[kind] = csv.writer(outfile, lineterminator='\n')
+                previous_rows = stack.enter_context(_open_csv_object(client, buckets[0], previous_key))
+                if rows is None:
+                    rows = stack.enter_context(_open_csv_object(client, buckets[0], s3_key))
+                for kind, row in diff_sorted_rows(previous_rows, rows, key_columns):
+                    writers[kind].writerow(row)
+                    counts[kind] += 1
+            for bucket in buckets[1:]:
+                for delta_key in delta_keys.values():
+                    copy_object(client, buckets[0], delta_key, bucket, delta_key)
+            results = {
+                'key': s3_key,
+                'previous_key': previous_key,
+                **counts,
+                'files': delta_keys,
+                'codec': codec.name,
+                'updated_at': datetime.now().isoformat(),
+            }
+            for bucket in buckets:
+                put_manifest(client, bucket, _get_delta_key(s3_key, '.json'), results)
+        except (BotoClientError, BotoConnectionError, DeltaError, S3UploadError) as e:
+            print(f'Error on delta: key={s3_key}, previous_key={previous_key}, {e}')
+            return False
+        counts_text = ', '.join(f'{kind}={count}' for kind, count in counts.items())
+        seconds = time.perf_counter() - start_time
+        print(f'Delta complete: key={s3_key}, previous_key={previous_key}, {counts_text}, seconds={seconds:.1f}')
+        return True
+
+    # Extracts rows updated since the dataset's high-water mark, less an overlap margin to catch rows committed late
+    # with an earlier last_updated. Without a mark, falls back to the fixed recency window.
+    def upload_incremental_query_results(self, get_query, s3_key, watermarks, dataset, term_id, fallback_cutoff):
+        watermark = watermarks.get(dataset, term_id)
+        if watermark:
+            overlap = timedelta(minutes=int(self.config.get('WATERMARK_OVERLAP_MINUTES', 30)))
+            recency_cutoff = watermark - overlap
+        else:
+            recency_cutoff = fallback_cutoff
+        query = get_query(term_id, recency_cutoff)
+        max_last_updated = None
+
+        def _write_results(outfile, metrics, parquet=None):
+            nonlocal max_last_updated
+            with self.resources.sisedo_connection() as sisedo:
+                row_count, last_row, max_last_updated = _write_csv_rows(
+                    sisedo, query, outfile, 'last_updated', metrics, self.pipeline_queue_size, parquet,
+                )
+            return row_count
+
+        print(f'Incremental extract: dataset={dataset}, term_id={term_id}, since={recency_cutoff.isoformat()}')
+        success = self.upload_stream(_write_results, s3_key, manifest=False)
+        if success and max_last_updated:
+            watermarks.set(dataset, term_id, max_last_updated)
+        return success
+
+    # One statement covers every term in s3_keys, a dict of term ids to keys, and its rows are routed to each term's
+    # key in turn as they arrive. Each key gets the same content as from a per-term extract, though rows within a term
+    # may come in another order where the per-term statement has no ORDER BY.
+    def upload_multi_term_query_results(self, get_query, s3_keys, batched=False, targets=None):
+        s3_keys = {term_id: s3_key for term_id, s3_key in s3_keys.items() if not self._is_uploaded(s3_key, targets)}
+        if not s3_keys:
+            return True
+        term_ids = sorted(s3_keys)
+        success = True
+        with self.resources.sisedo_connection() as sisedo:
+            if batched:
+                batches = _fetch_batched_query(sisedo, get_query(term_ids))
+            else:
+                sql, params = get_query(term_ids)
+                sisedo.execute(sql, params)
+                batches = iter(sisedo.fetchmany, [])
+            demux = TermDemultiplexer(batches, sisedo.description)
+            for term_id in term_ids:
+                def _write_term_rows(outfile, metrics, parquet=None, term_id=term_id):
+                    row_count, last_row, max_value = _write_csv_batches(
+                        demux.batches_for(term_id),
+                        sisedo.description,
+                        outfile,
+                        metrics=metrics,
+                        queue_size=self.pipeline_queue_size,
+                        parquet=parquet,
+                    )
+                    return row_count
+
+                if not self.upload_stream(_write_term_rows, s3_keys[term_id], targets, check_uploaded=False):
+                    success = False
+        return success
+
+    # With QUERY_CACHE on, results are written to the query cache as they are uploaded, and a later extract of the same
+    # query within QUERY_CACHE_TTL_MINUTES uploads the cached CSV instead of querying SISEDO. Parquet needs typed rows,
+    # which the cache doesn't keep, so an extract written as Parquet always queries.
+    def upload_query_results(self, query, s3_key, targets=None):
+        def _write_results(outfile, metrics, parquet=None):
+            cached = self.extract_cache.open(query) if self.extract_cache and not parquet else None
+            if cached:
+                infile, row_count = cached
+                with infile:
+                    shutil.copyfileobj(infile, outfile, 1024 * 1024)
+                print(f'Query results from cache: key={s3_key}, rows={row_count}')
+                return row_count
+            cache_writer = self.extract_cache.writer(query) if self.extract_cache else nullcontext()
+            with self.resources.sisedo_connection() as sisedo, cache_writer as cache_entry:
+                row_count, last_row, max_value = _write_csv_rows(
+                    sisedo,
+                    query,
+                    outfile,
+                    metrics=metrics,
+                    queue_size=self.pipeline_queue_size,
+                    parquet=parquet,
+                    cache_entry=cache_entry,
+                )
+                if cache_entry:
+                    cache_entry.row_count = row_count
+            return row_count
+
+        return self.upload_stream(_write_results, s3_key, targets)
+
+    # Each batch is compressed as a self-contained gzip member (or zstd frame), and S3 parts are only cut at batch
+    # boundaries. After each part is uploaded, the batch cursor and the parts so far are checkpointed to disk. If the
+    # extract fails, the multipart upload is left open, and a rerun on the same day picks up at the checkpointed batch
+    # without re-querying the batches before it.
+    def upload_resumable_batched_query_results(self, batch_query, s3_key, targets=None, check_uploaded=True):
+        if check_uploaded and self._is_uploaded(s3_key, targets):
+            return True
+        buckets = self.get_buckets(targets)
+        client = self.get_client()
+        codec = get_codec(self.config)
+        s3_key = _get_codec_key(s3_key, codec)
+        previous_manifest = self._get_previous_manifest(client, buckets[0], s3_key)
+        checkpoint = Checkpoint(self.config.get('CHECKPOINT_DIR', 'log/checkpoints'), s3_key)
+        state = checkpoint.load()
+        if state and not multipart_upload_exists(client, buckets[0], s3_key, state['upload_id']):
+            print(f'Checkpoint discarded, multipart upload is no longer open: key={s3_key}')
+            state = None
+        # A resumed extract doesn't write the rows before its checkpoint, so its delta can't be fed as it is written.
+        delta_feed = None if state else self.delta_feeds.pop(s3_key, None)
+        if state:
+            print(f"Resuming batched extract: key={s3_key}, batch={state['batch']}, rows={state['rows']}")
+        else:
+            state = {
+                'batch': 0,
+                'last_row': None,
+                'null_keys': False,
+                'rows': 0,
+                'raw_bytes': 0,
+                'batch_digests': [],
+                'upload_id': None,
+                'parts': [],
+                'compressed_bytes': 0,
+            }
+        start_time = time.perf_counter()
+        metrics = self.metrics.start_extract(s3_key, _get_dataset_name(s3_key))
+        try:
+            stream = self._open_upload_stream(
+                client,
+                buckets[0],
+                s3_key,
+                resumable=True,
+                upload_id=state['upload_id'],
+                parts=state['parts'],
+                bytes_written=state['compressed_bytes'],
+                metrics=metrics,
             )
-            self.upload_query_results(
-                queries.get_instructor_advisor_relationships(),
-                f'sis-data/sis-sysadm/{daily_path}/advisors/instructor-advisor-map/instructor-advisor-map.gz',
+            with stream:
+                with self.resources.sisedo_connection() as sisedo:
+                    while True:
+                        batch_start_time = time.perf_counter()
+                        stages_at_start = metrics.get_stages()
+                        query = batch_query(state['batch'], BATCH_SIZE, state['last_row'], state['null_keys'])
+                        if query is None:
+                            break
+                        compressed = codec.open(stream, metrics)
+                        fileobj = delta_feed.tee(compressed) if delta_feed else compressed
+                        with io.TextIOWrapper(fileobj, encoding='utf-8', newline='\n') as outfile:
+                            row_count, last_row, max_value = _write_csv_rows(
+                                sisedo, query, outfile, metrics=metrics, queue_size=self.pipeline_queue_size,
+                            )
+                        metrics.record_batch(
+                            state['batch'], row_count, time.perf_counter() - batch_start_time, stages_at_start,
+                        )
+                        state['batch'] += 1
+                        state['last_row'] = last_row
+                        state['rows'] += row_count
+                        state['raw_bytes'] += compressed.raw_size
+                        state['batch_digests'].append(compressed.sha256.hexdigest())
+                        # If we receive fewer rows than the batch size, we've read all available rows in this pass.
+                        # Keyset batches go on to a final pass over rows with a null leading key.
+                        if row_count < BATCH_SIZE:
+                            if state['null_keys']:
+                                break
+                            state['last_row'] = None
+                            state['null_keys'] = True
+                        # The part is sent while the next batch is fetched. Its checkpoint, the state as of the end
+                        # of this batch, is saved once it and every part before it have been acknowledged.
+                        if len(stream.buffer) >= stream.part_size:
+                            snapshot = {
+                                **state,
+                                'batch_digests': list(state['batch_digests']),
+                                'compressed_bytes': stream.bytes_written,
+                            }
+                            stream.flush_part(partial(_save_checkpoint, checkpoint, stream, snapshot))
+                # Batch digests stand in for a digest of the whole content, since hash state can't be checkpointed.
+                digest = hashlib.sha256(''.join(state['batch_digests']).encode()).hexdigest()
+                reused_key = _reuse_previous_upload(client, stream, previous_manifest, digest)
+            checkpoint.delete()
+            results = {
+                'key': s3_key,
+                'sha256': digest,
+                'rows': state['rows'],
+                'raw_bytes': state['raw_bytes'],
+                'compressed_bytes': stream.bytes_written,
+                'codec': codec.name,
+                'updated_at': datetime.now().isoformat(),
+            }
+            self._publish_upload(client, buckets, results, previous_manifest, reused_key)
+        except S3UploadError as e:
+            print(f'Error on S3 upload: key={s3_key}, {e}')
+            return False
+        metrics.finish(True, **_get_metrics_counts(results, codec))
+        _log_extract(results, codec, start_time, metrics)
+        return True
+
+    # CSV is written as part files of about SHARD_ROWS rows or SHARD_SIZE_MB of CSV under a prefix named for the key,
+    # so that sis-data/daily/<digest>-<date>/courses/courses-2248.gz becomes courses/courses-2248/part-00000.gz and so
+    # on. Once every part is uploaded, each target gets a manifest.json listing the parts with their row counts and
+    # sizes, with an 'entries' list in the form of a Redshift COPY manifest.
+    def upload_sharded_stream(self, write_rows, s3_key, targets=None, parquet=True):
+        buckets = self.get_buckets(targets)
+        client = self.get_client()
+        codec = get_codec(self.config)
+        s3_key = _get_codec_key(s3_key, codec)
+        write_rows, parquet_results = self._with_parquet(write_rows, client, buckets, s3_key, parquet)
+        prefix = os.path.splitext(s3_key)[0]
+        max_rows, max_bytes = self._get_shard_limits()
+        start_time = time.perf_counter()
+        metrics = self.metrics.start_extract(s3_key, _get_dataset_name(s3_key))
+        try:
+            writer = ShardedWriter(
+                partial(self._open_upload_stream, client, buckets[0], metrics=metrics),
+                codec,
+                prefix,
+                max_rows=max_rows,
+                max_bytes=max_bytes,
+                parallelism=int(self.config.get('SHARD_UPLOAD_PARALLELISM', 4)),
+                metrics=metrics,
             )
+            with writer:
+                row_count = write_rows(writer, metrics)
+            print(f'S3 upload complete: bucket={buckets[0]}, prefix={prefix}, parts={len(writer.parts)}')
+            for bucket in buckets[1:]:
+                for part in writer.parts:
+                    copy_object(client, buckets[0], part['key'], bucket, part['key'])
+                print(f'S3 copy complete: bucket={bucket}, prefix={prefix}, parts={len(writer.parts)}')
+            results = {
+                'key': s3_key,
+                'rows': row_count,
+                'raw_bytes': sum(p['raw_bytes'] for p in writer.parts),
+                'compressed_bytes': sum(p['compressed_bytes'] for p in writer.parts),
+                'codec': codec.name,
+                'updated_at': datetime.now().isoformat(),
+                'parts': writer.parts,
+            }
+            if parquet_results:
+                results['parquet'] = parquet_results
+            for bucket in buckets:
+                entries = [{
+                    'url': f"s3://{bucket}/{p['key']}",
+                    'mandatory': True,
+                    'meta': {'content_length': p['compressed_bytes']},
+                } for p in writer.parts]
+                put_manifest(client, bucket, f'{prefix}/manifest.json', {**results, 'entries': entries})
+        except S3UploadError as e:
+            print(f'Error on S3 upload: key={s3_key}, {e}')
+            return False
+        metrics.finish(True, parts=len(writer.parts), **_get_metrics_counts(results, codec))
+        _log_extract(results, codec, start_time, metrics)
+        return True
+
+    # Compressed CSV is sent to the first target bucket in multipart chunks as write_rows produces it, then copied
+    # server-side to any other targets. If the content digest matches the dataset's manifest and nothing has been
+    # uploaded yet, the PUT is skipped in favor of a server-side copy of the previous object. Callers that have already
+    # checked whether the extract was uploaded earlier today pass check_uploaded=False.
+    def upload_stream(self, write_rows, s3_key, targets=None, manifest=True, parquet=True, check_uploaded=True):
+        if check_uploaded and manifest and self._is_uploaded(s3_key, targets):
+            return True
+        if any(self._get_shard_limits()):
+            return self.upload_sharded_stream(write_rows, s3_key, targets, parquet)
+        buckets = self.get_buckets(targets)
+        client = self.get_client()
+        codec = get_codec(self.config)
+        s3_key = _get_codec_key(s3_key, codec)
+        write_rows, parquet_results = self._with_parquet(write_rows, client, buckets, s3_key, parquet)
+        previous_manifest = self._get_previous_manifest(client, buckets[0], s3_key) if manifest else None
+        delta_feed = self.delta_feeds.pop(s3_key, None)
+        start_time = time.perf_counter()
+        metrics = self.metrics.start_extract(s3_key, _get_dataset_name(s3_key))
+        try:
+            with self._open_upload_stream(client, buckets[0], s3_key, metrics=metrics) as stream:
+                compressed = codec.open(stream, metrics)
+                fileobj = delta_feed.tee(compressed) if delta_feed else compressed
+                with io.TextIOWrapper(fileobj, encoding='utf-8', newline='\n') as outfile:
+                    row_count = write_rows(outfile, metrics)
+                digest = compressed.sha256.hexdigest()
+                reused_key = _reuse_previous_upload(client, stream, previous_manifest, digest)
+            results = {
+                'key': s3_key,
+                'sha256': digest,
+                'rows': row_count,
+                'raw_bytes': compressed.raw_size,
+                'compressed_bytes': stream.bytes_written,
+                'codec': codec.name,
+                'updated_at': datetime.now().isoformat(),
+            }
+            if parquet_results:
+                results['parquet'] = parquet_results
+            self._publish_upload(client, buckets, results, previous_manifest, reused_key, manifest)
+        except S3UploadError as e:
+            print(f'Error on S3 upload: key={s3_key}, {e}')
+            return False
+        metrics.finish(True, **_get_metrics_counts(results, codec))
+        _log_extract(results, codec, start_time, metrics)
+        return True
+
+    # Runs an upload task, and writes the delta of each extract that it uploaded. An extract that the task writes from
+    # its first row feeds its rows to the delta as they are written, and the previous day's extract is read alongside
+    # it. Any other, such as one resumed from a checkpoint or skipped as already uploaded today, is downloaded and
+    # decompressed again once the task is done.
+    def upload_with_delta(self, upload, s3_keys, key_columns):
+        if any(self._get_shard_limits()):
+            if not upload():
+                return False
+            print(f'Delta skipped, sharded extracts are not compared: keys={s3_keys}')
+            return True
+        codec = get_codec(self.config)
+        keys = s3_keys.values() if isinstance(s3_keys, dict) else [s3_keys]
+        feeds = {s3_key: DeltaFeed(partial(self.upload_delta, s3_key, key_columns)) for s3_key in keys}
+        for s3_key, feed in feeds.items():
+            self.delta_feeds[_get_codec_key(s3_key, codec)] = feed
+        success = False
+        try:
+            success = upload()
+        finally:
+            for s3_key, feed in feeds.items():
+                self.delta_feeds.pop(_get_codec_key(s3_key, codec), None)
+                feed.finish(success)
+        if not success:
+            return False
+        return all([f.result if f.started else self.upload_delta(s3_key, key_columns) for s3_key, f in feeds.items()])
+
+    def _get_previous_daily_key(self, client, bucket, s3_key):
+        today = datetime.now()
+        base_key = os.path.splitext(s3_key)[0]
+        for days in range(1, int(self.config.get('DELTA_LOOKBACK_DAYS', 7)) + 1):
+            daily_path = get_daily_path(today - timedelta(days=days))
+            # The previous upload may have been written with another codec.
+            for extension in ('.gz', '.zst'):
+                previous_key = DAILY_PATH_PATTERN.sub(f'{daily_path}/', base_key + extension)
+                if get_object_size(client, bucket, previous_key) is not None:
+                    return previous_key
+        return None
+
+    def _get_previous_manifest(self, client, bucket, s3_key):
+        if self.config.get('S3_SKIP_UNCHANGED', 'true') == 'true':
+            return get_manifest(client, bucket, get_manifest_key(s3_key))
+
+    def _get_shard_limits(self):
+        max_rows = int(self.config.get('SHARD_ROWS', 0))
+        max_bytes = int(self.config.get('SHARD_SIZE_MB', 0)) * 1024 * 1024
+        return max_rows, max_bytes
+
+    def _get_tasks(self):
+        daily_path = get_daily_path()
+        if self.name == 'upload_advisors':
+            return [
+                partial(
+                    self.upload_query_results,
+                    queries.get_advisor_notes_access(),
+                    f'sis-data/sis-sysadm/{daily_path}/advisors/advisor-note-permissions/advisor-note-permissions.gz',
+                ),
+                partial(
+                    self.upload_query_results,
+                    queries.get_instructor_advisor_relationships(),
+                    f'sis-data/sis-sysadm/{daily_path}/advisors/instructor-advisor-map/instructor-advisor-map.gz',
+                ),
+            ]
         elif self.name == 'upload_recent_refresh':
+            tasks = []
             recency_cutoff = datetime.fromtimestamp(time.time() - (RECENT_REFRESH_CUTOFF_DAYS * 86400))
-            for term_id in self.get_current_term_ids():
-                self.upload_query_results(
+            if self.config.get('RECENT_REFRESH_MODE', 'window') == 'watermark':
+                # Incremental runs may happen many times a day, so each run gets its own key under the daily path.
+                run_time = datetime.now().strftime('%H%M%S')
+                watermarks = WatermarkStore(self.config, self.resources)
+                for term_id in self.get_current_term_ids():
+                    tasks.append(partial(
+                        self.upload_incremental_query_results,
+                        queries.get_recent_instructor_updates,
+                        f'sis-data/{daily_path}/instructor_updates/instructor-updates-{term_id}-{run_time}.gz',
+                        watermarks,
+                        'instructor_updates',
+                        term_id,
+                        recency_cutoff,
+                    ))
+                    tasks.append(partial(
+                        self.upload_incremental_query_results,
+                        queries.get_recent_enrollment_updates,
+                        f'sis-data/{daily_path}/enrollment_updates/enrollment-updates-{term_id}-{run_time}.gz',
+                        watermarks,
+                        'enrollment_updates',
+                        term_id,
+                        recency_cutoff,
+                    ))
+                return tasks
+            term_ids = self.get_current_term_ids()
+            if self.config.get('MULTI_TERM_QUERIES', 'false') == 'true':
+                return [
+                    partial(
+                        self.upload_multi_term_query_results,
+                        partial(queries.get_multi_term_recent_instructor_updates, recency_cutoff=recency_cutoff),
+                        {t: f'sis-data/{daily_path}/instructor_updates/instructor-updates-{t}.gz' for t in term_ids},
+                    ),
+                    partial(
+                        self.upload_multi_term_query_results,
+                        partial(queries.get_multi_term_recent_enrollment_updates, recency_cutoff=recency_cutoff),
+                        {t: f'sis-data/{daily_path}/enrollment_updates/enrollment-updates-{t}.gz' for t in term_ids},
+                    ),
+                ]
+            for term_id in term_ids:
+                tasks.append(partial(
+                    self.upload_query_results,
                     queries.get_recent_instructor_updates(term_id, recency_cutoff),
                     f'sis-data/{daily_path}/instructor_updates/instructor-updates-{term_id}.gz',
-                )
-                self.upload_query_results(
+                ))
+                tasks.append(partial(
+                    self.upload_query_results,
                     queries.get_recent_enrollment_updates(term_id, recency_cutoff),
                     f'sis-data/{daily_path}/enrollment_updates/enrollment-updates-{term_id}.gz',
-                )
+                ))
+            return tasks
         elif self.name == 'upload_snapshot':
-            self.upload_batched_query_results(
-                queries.get_basic_attributes(),
-                f'sis-data/{daily_path}/basic-attributes/basic-attributes.gz',
-            )
-            for term_id in self.get_current_term_ids():
-                self.upload_query_results(
-                    queries.get_term_courses(term_id),
-                    f'sis-data/{daily_path}/courses/courses-{term_id}.gz',
+            keyset = self.config.get('BATCH_PAGINATION', 'keyset') == 'keyset'
+            chunked = self.config.get('CHUNKED_EXTRACTS', 'false') == 'true'
+            # Basic attributes is the longest extract, so it goes first in the queue.
+            if chunked:
+                basic_attributes_task = partial(
+                    self.upload_chunked_query_results,
+                    (queries.get_basic_attributes_boundaries, queries.get_basic_attributes_chunk),
+                    f'sis-data/{daily_path}/basic-attributes/basic-attributes.gz',
                 )
-                self.upload_batched_query_results(
-                    queries.get_term_enrollments(term_id),
-                    f'sis-data/{daily_path}/enrollments/enrollments-{term_id}.gz',
+            else:
+                basic_attributes_task = partial(
+                    self.upload_batched_query_results,
+                    queries.get_basic_attributes(keyset=keyset),
+                    f'sis-data/{daily_path}/basic-attributes/basic-attributes.gz',
                 )
+            tasks = [self._with_delta(basic_attributes_task, BASIC_ATTRIBUTES_DELTA_KEY)]
+            term_ids = self.get_current_term_ids()
+            if self.config.get('MULTI_TERM_QUERIES', 'false') == 'true':
+                tasks.append(partial(
+                    self.upload_multi_term_query_results,
+                    queries.get_multi_term_courses,
+                    {t: f'sis-data/{daily_path}/courses/courses-{t}.gz' for t in term_ids},
+                ))
+                tasks.append(self._with_delta(partial(
+                    self.upload_multi_term_query_results,
+                    partial(queries.get_multi_term_enrollments, keyset=keyset),
+                    {t: f'sis-data/{daily_path}/enrollments/enrollments-{t}.gz' for t in term_ids},
+                    batched=True,
+                ), ENROLLMENTS_DELTA_KEY))
+                return tasks
+            for term_id in term_ids:
+                tasks.append(partial(
+                    self.upload_query_results,
+                    queries.get_term_courses(term_id),
+                    f'sis-data/{daily_path}/courses/courses-{term_id}.gz',
+                ))
+                if chunked:
+                    enrollments_task = partial(
+                        self.upload_chunked_query_results,
+                        (
+                            partial(queries.get_term_enrollments_boundaries, term_id),
+                            partial(queries.get_term_enrollments_chunk, term_id),
+                        ),
+                        f'sis-data/{daily_path}/enrollments/enrollments-{term_id}.gz',
+                    )
+                else:
+                    enrollments_task = partial(
+                        self.upload_batched_query_results,
+                        queries.get_term_enrollments(term_id, keyset=keyset),
+                        f'sis-data/{daily_path}/enrollments/enrollments-{term_id}.gz',
+                    )
+                tasks.append(self._with_delta(enrollments_task, ENROLLMENTS_DELTA_KEY))
+            return tasks
         else:
-            print(f"Job {self.name} not found, aborting")
+            return None
 
-    def get_client(self):
-        session = self.get_session()
-        return session.client('s3', region_name=self.config['AWS_REGION'])
+    # With SKIP_UPLOADED_EXTRACTS on, an extract is skipped if an earlier run today completed it: every target has a
+    # manifest naming today's key, and the objects that manifest lists, including any parts or Parquet file, are there
+    # with the sizes it gives.
+    def _is_uploaded(self, s3_key, targets=None):
+        if not self.skip_uploaded:
+            return False
+        client = self.get_client()
+        s3_key = _get_codec_key(s3_key, get_codec(self.config))
+        sharded = any(self._get_shard_limits())
+        for bucket in self.get_buckets(targets):
+            if sharded:
+                manifest = get_manifest(client, bucket, f'{os.path.splitext(s3_key)[0]}/manifest.json')
+            else:
+                manifest = get_manifest(client, bucket, get_manifest_key(s3_key))
+            if not manifest or manifest.get('key') != s3_key:
+                return False
+            if _get_dataset_folder(s3_key) in self.parquet_datasets and 'parquet' not in manifest:
+                return False
+            if sharded:
+                objects = [(p['key'], p['compressed_bytes']) for p in manifest.get('parts', [])]
+            else:
+                objects = [(s3_key, manifest['compressed_bytes'])]
+            if 'parquet' in manifest:
+                objects.append((manifest['parquet']['key'], manifest['parquet']['bytes']))
+            if any(get_object_size(client, bucket, key) != size for key, size in objects):
+                return False
+        print(f'Extract skipped, already uploaded today: key={s3_key}')
+        return True
 
-    def get_current_term_ids(self):
-        with sisedo_connection(self.config) as sisedo:
-            term_ids = [r[0] for r in sisedo.execute(queries.get_current_terms())]
-        return term_ids
+    def _open_upload_stream(self, client, bucket, s3_key, **kwargs):
+        part_size = int(self.config.get('S3_PART_SIZE_MB', 16)) * 1024 * 1024
+        max_pending_parts = int(self.config.get('S3_MAX_PENDING_PARTS', 2))
+        return S3UploadStream(client, bucket, s3_key, part_size, max_pending_parts, **kwargs)
 
-    def get_session(self):
-        if self.config['AWS_ROLE_ARN']:
-            credentials = self.get_sts_credentials()
-            return boto3.Session(
-                aws_access_key_id=credentials['AccessKeyId'],
-                aws_secret_access_key=credentials['SecretAccessKey'],
-                aws_session_token=credentials['SessionToken'],
-            )
+    def _publish_upload(self, client, buckets, results, previous_manifest, reused_key, manifest=True):
+        s3_key = results['key']
+        if reused_key == s3_key:
+            print(f'S3 upload skipped, content unchanged: bucket={buckets[0]}, key={s3_key}')
+        elif reused_key:
+            copy_object(client, buckets[0], reused_key, buckets[0], s3_key)
+            print(f'S3 copy complete, content unchanged: bucket={buckets[0]}, key={s3_key}, source={reused_key}')
         else:
-            return boto3.Session(
-                aws_access_key_id=self.config['AWS_ACCESS_KEY_ID'],
-                aws_secret_access_key=self.config['AWS_SECRET_ACCESS_KEY'],
-            )
+            print(f'S3 upload complete: bucket={buckets[0]}, key={s3_key}')
+        if reused_key:
+            results['compressed_bytes'] = previous_manifest['compressed_bytes']
+        for bucket in buckets[1:]:
+            copy_object(client, buckets[0], s3_key, bucket, s3_key)
+            print(f'S3 copy complete: bucket={bucket}, key={s3_key}')
+        if manifest:
+            for bucket in buckets:
+                put_manifest(client, bucket, get_manifest_key(s3_key), results)
 
-    def get_sts_credentials(self):
-        sts_client = boto3.client('sts')
-        assumed_role_object = sts_client.assume_role(
-            RoleArn=self.config['AWS_ROLE_ARN'],
-            RoleSessionName='AssumeAppRoleSession',
-            DurationSeconds=3600,
+    def _spool_chunk(self, query, metrics, cancelled):
+        if cancelled.is_set():
+            raise CancelledError()
+        start_time = time.perf_counter()
+        chunk_metrics = metrics.get_chunk_metrics()
+        spool = tempfile.TemporaryFile(
+            mode='w+',
+            encoding='utf-8',
+            newline='\n',
+            dir=self.config.get('CHUNK_SPOOL_DIR') or None,
         )
-        return assumed_role_object['Credentials']
-
-    def upload_batched_query_results(self, batch_query, s3_key):
-        with tempfile.TemporaryFile() as results_tempfile:
-            results_gzipfile = gzip.GzipFile(mode='wb', fileobj=results_tempfile)
-            with io.TextIOWrapper(results_gzipfile, encoding='utf-8', newline='\n') as outfile:
-                with sisedo_connection(self.config) as sisedo:
-                    batch = 0
-                    while True:
-                        sql = batch_query(batch, BATCH_SIZE)
-                        row_count = _write_csv_rows(sisedo, sql, outfile)
-                        # If we receive fewer rows than the batch size, we've read all available rows and are done.
-                        if row_count < BATCH_SIZE:
-                            break
-                        batch += 1
-            results_gzipfile.close()
+        try:
+            with self.resources.sisedo_connection() as sisedo:
+                row_count, last_row, max_value = _write_csv_rows(sisedo, query, spool, metrics=chunk_metrics)
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        return spool, row_count, time.perf_counter() - start_time, chunk_metrics
 
-            self.upload_data(results_tempfile, s3_key)
+    def _with_delta(self, task, key_columns):
+        if self.config.get('DELTA_EXTRACTS', 'false') != 'true':
+            return task
+        return partial(self.upload_with_delta, task, task.args[1], key_columns)
 
-    def upload_data(self, data, s3_key, targets=None):
-        if not targets:
-            if 'TARGETS' in self.config:
-                targets = self.config['TARGETS']
-            else:
-                print('No S3 targets specified, aborting')
-                exit()
-        client = self.get_client()
-        for bucket in targets.split(','):
-            try:
-                data.seek(0)
-                client.put_object(Bucket=bucket, Key=s3_key, Body=data, ServerSideEncryption='AES256')
-            except (BotoClientError, BotoConnectionError, ValueError) as e:
-                print(f'Error on S3 upload: bucket={bucket}, key={s3_key}, error={e}')
-                return False
-            print(f'S3 upload complete: bucket={bucket}, key={s3_key}')
-        return True
+    # Datasets named in PARQUET_DATASETS by folder, such as 'enrollments', are also written as Parquet from the same
+    # fetched rows, under a sibling '-parquet' folder: enrollments/enrollments-2248.gz gets
+    # enrollments-parquet/enrollments-2248.parquet. The returned write_rows hands its Parquet writer on to the given
+    # one, and the returned dict gets the Parquet object's key, rows and size, for the extract's manifest.
+    def _with_parquet(self, write_rows, client, buckets, s3_key, parquet=True):
+        if not parquet or _get_dataset_folder(s3_key) not in self.parquet_datasets:
+            return write_rows, None
+        folder, filename = os.path.split(s3_key)
+        parquet_key = f'{folder}-parquet/{os.path.splitext(filename)[0]}.parquet'
+        parquet_results = {'key': parquet_key}
+        dictionary_columns = [c.strip() for c in self.config.get('PARQUET_DICTIONARY_COLUMNS', '').split(',')]
 
-    def upload_query_results(self, sql, s3_key, targets=None):
-        with tempfile.TemporaryFile() as results_tempfile:
-            results_gzipfile = gzip.GzipFile(mode='wb', fileobj=results_tempfile)
-            with io.TextIOWrapper(results_gzipfile, encoding='utf-8', newline='\n') as outfile:
-                with sisedo_connection(self.config) as sisedo:
-                    _write_csv_rows(sisedo, sql, outfile)
-            results_gzipfile.close()
+        def _write_rows(outfile, metrics):
+            with self._open_upload_stream(client, buckets[0], parquet_key, metrics=metrics) as stream:
+                writer = ParquetWriter(
+                    stream,
+                    dictionary_columns,
+                    row_group_rows=int(self.config.get('PARQUET_ROW_GROUP_ROWS', 100000)),
+                    compression=self.config.get('PARQUET_COMPRESSION', 'zstd'),
+                    metrics=metrics,
+                )
+                row_count = write_rows(outfile, metrics, writer)
+                writer.close()
+            for bucket in buckets[1:]:
+                copy_object(client, buckets[0], parquet_key, bucket, parquet_key)
+            parquet_results['rows'] = writer.row_count
+            parquet_results['bytes'] = stream.bytes_written
+            print(f'Parquet upload complete: key={parquet_key}, rows={writer.row_count}, bytes={stream.bytes_written}')
+            return row_count
 
-            self.upload_data(results_tempfile, s3_key, targets)
+        return _write_rows, parquet_results
 
 
-def get_daily_path():
-    today = datetime.now().strftime('%Y-%m-%d')
+def get_daily_path(date=None):
+    today = (date or datetime.now()).strftime('%Y-%m-%d')
     digest = hashlib.md5(today.encode()).hexdigest()
     return f"daily/{digest}-{today}"
 
 
-@contextmanager
-def sisedo_connection(config):
-    with oracledb.connect(
-        user=config['SISEDO_UN'],
-        password=config['SISEDO_PW'],
-        host=config['SISEDO_HOST'],
-        port=config['SISEDO_PORT'],
-        sid=config['SISEDO_SID'],
-    ) as connection:
-        with connection.cursor() as cursor:
-            yield cursor
-
-
-def _write_csv_rows(connection, sql, outfile):
-    def _coerce(column_name, e):
-        if isinstance(e, datetime):
-            # last_updated values come in with a UTC timezone, which is wrong; they should be treated as local time.
-            if column_name == 'last_updated':
-                return e.astimezone(pytz.timezone('America/Los_Angeles')).strftime('%Y-%m-%d %H:%M:%S %z')
+# Runs successive batch statements on the cursor, yielding fetched rows until a batch comes back short and, for keyset
+# batches, the final pass over rows with a null leading key has also come back short. The first statement is executed
+# before returning, so that the cursor's description is available to the caller.
+def _fetch_batched_query(cursor, batch_query):
+    sql, params = batch_query(0, BATCH_SIZE, None)
+    cursor.execute(sql, params)
+
+    def _batches():
+        batch = 0
+        null_keys = False
+        while True:
+            row_count = 0
+            last_row = None
+            for rows in iter(cursor.fetchmany, []):
+                row_count += len(rows)
+                last_row = rows[-1]
+                yield rows
+            batch += 1
+            if row_count < BATCH_SIZE:
+                if null_keys:
+                    break
+                last_row = None
+                null_keys = True
+            query = batch_query(batch, BATCH_SIZE, last_row, null_keys)
+            if query is None:
+                break
+            sql, params = query
+            cursor.execute(sql, params)
+
+    return _batches()
+
+
+def _format_local_timestamp(value):
+    # last_updated values come in with a UTC timezone, which is wrong; they should be treated as local time.
+    if value is None:
+        return None
+    return value.astimezone(LOCAL_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S %z')
+
+
+def _format_utc_timestamp(value):
+    if value is None:
+        return None
+    return value.strftime('%Y-%m-%d %H:%M:%S UTC')
+
+
+def _get_codec_key(s3_key, codec):
+    if s3_key.endswith('.gz'):
+        return s3_key[:-3] + codec.extension
+    return s3_key
+
+
+def _get_dataset_folder(s3_key):
+    return os.path.basename(os.path.dirname(s3_key))
+
+
+# Extracts are tracked in metrics by file name, less the extension and any run time.
+def _get_dataset_name(s3_key):
+    return RUN_TIME_PATTERN.sub('', os.path.basename(s3_key).split('.')[0])
+
+
+# Delta files go under a sibling of the extract's folder, so that loaders reading the folder see only full extracts.
+def _get_delta_key(s3_key, suffix):
+    folder, filename = os.path.split(s3_key)
+    return f'{folder}-delta/{os.path.splitext(filename)[0]}{suffix}'
+
+
+def _get_metrics_counts(results, codec):
+    return {
+        'rows': results['rows'],
+        'raw_bytes': results['raw_bytes'],
+        'compressed_bytes': results['compressed_bytes'],
+        'codec': codec.name,
+        'level': codec.level,
+    }
+
+
+# Converters are worked out once per query from the cursor description, rather than by inspecting every cell.
+def _get_column_converters(description):
+    converters = []
+    for idx, column in enumerate(description):
+        if column[1] in DATETIME_TYPES:
+            if column[0].lower() == 'last_updated':
+                converters.append((idx, _format_local_timestamp))
             else:
-                return e.strftime('%Y-%m-%d %H:%M:%S UTC')
-        else:
-            return e
-
-    results_writer = csv.writer(outfile, lineterminator='\n')
-    result = connection.execute(sql)
-    column_names = [c[0].lower() for c in result.description]
-    for row_count, r in enumerate(result):
-        results_writer.writerow([_coerce(column_names[idx], e) for idx, e in enumerate(r)])
-
-    try:
-        return row_count + 1
-    except NameError:
-        return 0
+                converters.append((idx, _format_utc_timestamp))
+    return converters
+
+
+def _log_extract(results, codec, start_time, metrics):
+    elapsed = max(time.perf_counter() - start_time, 0.001)
+    ratio = results['raw_bytes'] / max(results['compressed_bytes'], 1)
+    stages = ', '.join(f'{stage}={seconds:.1f}' for stage, seconds in metrics.stages.items())
+    print(
+        f'Extract complete: key={results["key"]}, rows={results["rows"]}, seconds={elapsed:.1f}, '
+        f'rows/sec={results["rows"] / elapsed:.0f}, codec={codec.name}, level={codec.level}, '
+        f'raw_bytes={results["raw_bytes"]}, compressed_bytes={results["compressed_bytes"]}, ratio={ratio:.2f}, '
+        f'stage_seconds=({stages})',
+    )
+
+
+@contextmanager
+def _open_csv_object(client, bucket, key):
+    body = client.get_object(Bucket=bucket, Key=key)['Body']
+    with io.TextIOWrapper(open_decompressed(body, key), encoding='utf-8', newline='') as infile:
+        yield csv.reader(infile)
+
+
+# An upload that fits in one part and matches the previous manifest is discarded before it is sent, provided the
+# previous object is still in place to copy from.
+def _reuse_previous_upload(client, stream, previous_manifest, digest):
+    if not previous_manifest or previous_manifest['sha256'] != digest or stream.multipart:
+        return None
+    if get_object_size(client, stream.bucket, previous_manifest['key']) != previous_manifest['compressed_bytes']:
+        return None
+    stream.discard()
+    return previous_manifest['key']
+
+
+# Queries are (sql, params) pairs. Executing with bind variables lets repeated statements, such as successive batches
+# or the same extract for another term, be served from the connection's statement cache without a hard parse.
+def _save_checkpoint(checkpoint, stream, state, parts):
+    checkpoint.save({**state, 'upload_id': stream.upload_id, 'parts': parts})
+
+
+def _write_csv_rows(
+    cursor, query, outfile, max_column=None, metrics=None, queue_size=0, parquet=None, cache_entry=None,
+):
+    sql, params = query
+    with timed(metrics, 'execute'):
+        cursor.execute(sql, params)
+    return _write_csv_batches(
+        iter(cursor.fetchmany, []), cursor.description, outfile, max_column, metrics, queue_size, parquet, cache_entry,
+    )
+
+
+# With a pipeline queue size, rows are fetched and encoded on threads of their own while the caller compresses and
+# uploads the CSV produced so far.
+def _write_csv_batches(
+    batches, description, outfile, max_column=None, metrics=None, queue_size=0, parquet=None, cache_entry=None,
+):
+    converters = _get_column_converters(description)
+    if parquet:
+        parquet.start(description)
+    max_idx = None
+    if max_column:
+        max_idx = [c[0].lower() for c in description].index(max_column)
+    max_value = None
+    row_count = 0
+    last_row = None
+
+    def _fetch_rows():
+        nonlocal row_count, last_row
+        batches_iterator = iter(batches)
+        while True:
+            with timed(metrics, 'fetch'):
+                rows = next(batches_iterator, None)
+            if not rows:
+                break
+            row_count += len(rows)
+            last_row = rows[-1]
+            yield rows
+
+    def _encode_rows(rows):
+        nonlocal max_value
+        with timed(metrics, 'encode'):
+            # Parquet gets the rows as fetched, before any values are formatted as text.
+            if parquet:
+                parquet.write_rows(rows)
+            if max_idx is not None:
+                batch_max = max((r[max_idx] for r in rows if r[max_idx] is not None), default=None)
+                if batch_max is not None and (max_value is None or batch_max > max_value):
+                    max_value = batch_max
+            if converters:
+                rows = [list(r) for r in rows]
+                for r in rows:
+                    for idx, convert in converters:
+                        r[idx] = convert(r[idx])
+            encoded = io.StringIO()
+            csv.writer(encoded, lineterminator='\n').writerows(rows)
+            return encoded.getvalue(), len(rows)
+
+    def _write_encoded(encoded):
+        text, encoded_row_count = encoded
+        outfile.write(text)
+        if cache_entry:
+            cache_entry.write(text)
+        # Sharded output may only be cut between batches, where the row count is known.
+        if isinstance(outfile, ShardedWriter):
+            outfile.end_batch(encoded_row_count)
+
+    if queue_size:
+        Pipeline(queue_size, 'extract').run(_fetch_rows, [_encode_rows], _write_encoded)
+    else:
+        for rows in _fetch_rows():
+            _write_encoded(_encode_rows(rows))
+
+    # The last row fetched is handed back so that keyset batches can seek past it, along with the greatest raw value of
+    # max_column, if any, for watermarks.
+    return row_count, last_row, max_value
@@ -0,0 +1,180 @@
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+
+from jonesy.files import replace_file
+
+
+STAGES = ['execute', 'fetch', 'encode', 'parquet', 'compress', 'upload', 'upload_parts']
+
+
+class ExtractMetrics:
+
+    # Stage times are exclusive within a thread: the write path nests (CSV writes into the compressor, which writes
+    # into the upload stream), so time spent in an inner stage is paused out of the stage that called it. Stages run
+    # on different threads, such as pipelined fetch and encode or upload_parts, the time background threads spend
+    # sending multipart parts, overlap one another and can add up to more than the wall-clock time.
+    def __init__(self, job_name, s3_key, dataset):
+        self.job_name = job_name
+        self.s3_key = s3_key
+        self.dataset = dataset
+        self.batches = []
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {stage: 0.0 for stage in STAGES}
+        self.started_at = datetime.now(timezone.utc)
+        self.start_time = time.perf_counter()
+        self.seconds = None
+        self.success = False
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self, success, **counts):
+        self.seconds = time.perf_counter() - self.start_time
+        self.success = success
+        self.counts.update(counts)
+
+    # Chunks of an extract are fetched alongside one another, so each times its stages on metrics of its own, which
+    # are merged into the extract's once the chunk is written.
+    def get_chunk_metrics(self):
+        return ExtractMetrics(self.job_name, self.s3_key, self.dataset)
+
+    def get_stages(self):
+        with self.lock:
+            return dict(self.stages)
+
+    def merge(self, chunk_metrics):
+        for stage, seconds in chunk_metrics.get_stages().items():
+            self.add(stage, seconds)
+
+    # A batch's stage times are the change in the extract's stage totals since stages_at_start, taken with get_stages()
+    # as the batch began.
+    def record_batch(self, batch, rows, seconds, stages_at_start):
+        stages = {stage: value - stages_at_start.get(stage, 0.0) for stage, value in self.get_stages().items()}
+        self.batches.append({
+            'batch': batch,
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'stages': {stage: round(value, 3) for stage, value in stages.items()},
+        })
+
+    @contextmanager
+    def time(self, stage):
+        stack = self.local.__dict__.setdefault('stack', [])
+        now = time.perf_counter()
+        if stack:
+            parent_stage, parent_start = stack[-1]
+            self.add(parent_stage, now - parent_start)
+        stack.append((stage, now))
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.add(stage, now - stack.pop()[1])
+            if stack:
+                stack[-1] = (stack[-1][0], now)
+
+    def to_record(self):
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.start_time
+        rows = self.counts.get('rows', 0)
+        return {
+            'type': 'extract',
+            'job': self.job_name,
+            'key': self.s3_key,
+            'dataset': self.dataset,
+            'started_at': self.started_at.isoformat(),
+            'success': self.success,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(rows / seconds, 1) if seconds else 0,
+            **self.counts,
+            'stages': {stage: round(value, 3) for stage, value in self.stages.items()},
+            'batches': self.batches,
+        }
+
+
+class RunMetrics:
+
+    # Collects the metrics of every extract in a job run. When the run finishes they are appended as JSON lines to
+    # METRICS_PATH and, if METRICS_TEXTFILE_DIR is set, written as a Prometheus textfile-collector file for the job.
+    def __init__(self, job_name):
+        self.job_name = job_name
+        self.extracts = []
+        self.lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.start_time = time.perf_counter()
+
+    def start_extract(self, s3_key, dataset):
+        extract = ExtractMetrics(self.job_name, s3_key, dataset)
+        with self.lock:
+            self.extracts.append(extract)
+        return extract
+
+    def write(self, config, success):
+        seconds = time.perf_counter() - self.start_time
+        records = [e.to_record() for e in self.extracts]
+        summary = {
+            'type': 'job',
+            'job': self.job_name,
+            'started_at': self.started_at.isoformat(),
+            'success': success,
+            'seconds': round(seconds, 3),
+            'extracts': len(records),
+            'rows': sum(r.get('rows', 0) for r in records),
+        }
+        metrics_path = config.get('METRICS_PATH', 'log/metrics.jsonl')
+        if metrics_path:
+            os.makedirs(os.path.dirname(metrics_path) or '.', exist_ok=True)
+            with open(metrics_path, 'a') as f:
+                for record in records + [summary]:
+                    f.write(json.dumps(record) + '\n')
+        textfile_dir = config.get('METRICS_TEXTFILE_DIR')
+        if textfile_dir:
+            path = os.path.join(textfile_dir, f'jonesy_{self.job_name}.prom')
+            replace_file(path, self._to_textfile(records, summary))
+
+    def _to_textfile(self, records, summary):
+        job = self.job_name
+        lines = []
+
+        def _metric(name, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value}')
+
+        def _extract_samples(field):
+            return [({'job': job, 'dataset': r['dataset']}, r.get(field, 0)) for r in records]
+
+        _metric('jonesy_job_success', 'Whether the last run of the job succeeded.', [
+            ({'job': job}, int(summary['success'])),
+        ])
+        _metric('jonesy_job_duration_seconds', 'Wall-clock time of the last run.', [({'job': job}, summary['seconds'])])
+        _metric(
+            'jonesy_job_last_run_timestamp_seconds',
+            'Start time of the last run.',
+            [({'job': job}, int(self.started_at.timestamp()))],
+        )
+        _metric('jonesy_extract_success', 'Whether the extract succeeded.', [
+            ({'job': job, 'dataset': r['dataset']}, int(r['success'])) for r in records
+        ])
+        _metric('jonesy_extract_seconds', 'Wall-clock time of the extract.', _extract_samples('seconds'))
+        _metric('jonesy_extract_rows', 'Rows written by the extract.', _extract_samples('rows'))
+        _metric('jonesy_extract_rows_per_second', 'Rows written per second.', _extract_samples('rows_per_sec'))
+        _metric('jonesy_extract_raw_bytes', 'Uncompressed CSV bytes.', _extract_samples('raw_bytes'))
+        _metric('jonesy_extract_compressed_bytes', 'Compressed bytes.', _extract_samples('compressed_bytes'))
+        _metric('jonesy_extract_stage_seconds', 'Time spent in each stage of the extract.', [
+            ({'job': job, 'dataset': r['dataset'], 'stage': stage}, value)
+            for r in records for stage, value in r['stages'].items()
+        ])
+        return '\n'.join(lines) + '\n'
+
+
+def timed(metrics, stage):
+    return metrics.time(stage) if metrics else nullcontext()
@@ -0,0 +1,104 @@
+import queue
+import threading
+
+
+# Marks the end of a stage's output.
+_END = object()
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Pipeline:
+
+    # The source and each stage run on threads of their own, handing items on over queues of at most queue_size
+    # items, and the sink runs on the caller's thread. A full queue blocks the stage feeding it, so a slow stage holds
+    # back the ones upstream and memory use is bounded by the queue sizes, not by the size of the result set. If any
+    # stage fails, the rest are cancelled and the first error is raised to the caller.
+    def __init__(self, queue_size=4, name='pipeline'):
+        self.queue_size = queue_size
+        self.name = name
+        self.cancelled = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+
+    def run(self, source, stages, sink):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(stages) + 1)]
+        threads = [threading.Thread(
+            target=self._run_source,
+            args=(source, queues[0]),
+            name=f'{self.name}-source',
+            daemon=True,
+        )]
+        for idx, stage in enumerate(stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(stage, queues[idx], queues[idx + 1]),
+                name=f'{self.name}-stage-{idx}',
+                daemon=True,
+            ))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    break
+                sink(item)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for thread in threads:
+                thread.join()
+        if self.error:
+            raise self.error
+
+    def _fail(self, error):
+        with self.lock:
+            if not self.error:
+                self.error = error
+        self.cancelled.set()
+
+    def _get(self, from_queue):
+        while True:
+            try:
+                return from_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.cancelled.is_set():
+                    raise PipelineCancelled()
+
+    def _put(self, to_queue, item):
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                to_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _run_source(self, source, to_queue):
+        try:
+            for item in source():
+                self._put(to_queue, item)
+            self._put(to_queue, _END)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _run_stage(self, stage, from_queue, to_queue):
+        try:
+            while True:
+                item = self._get(from_queue)
+                if item is _END:
+                    break
+                self._put(to_queue, stage(item))
+            self._put(to_queue, _END)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            self._fail(e)
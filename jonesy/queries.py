@@ -19,40 +19,149 @@ omit_drops_and_withdrawals = """
     ELSE enroll.GRADE_MARK END != 'W'"""
 
 
+basic_attributes_select = """
+    SELECT
+        pi.ldap_uid, pi.student_id AS sid, TRIM(pi.first_name) AS first_name, TRIM(pi.last_name) as last_name,
+        pi.email_address, pi.affiliations, pi.person_type, pi.alternateid
+    FROM SISEDO.CALCENTRAL_PERSON_INFO_VW pi
+    WHERE person_type != 'Z' AND affiliations IS NOT NULL"""
+
+term_courses_select = """
+    SELECT DISTINCT
+        TO_CHAR(CLASS_NBR) AS section_id,
+        STRM AS term_id,
+        SESSION_CODE AS session_id,
+        SUBJECT AS dept_name,
+        SUBJECT AS dept_code,
+        ACAD_CAREER AS course_career_code,
+        SCHEDULE_PRINT AS print_in_schedule_of_classes,
+        CASE WHEN PRIMARY_FLAG = 'Y' THEN 'true' ELSE 'false' END AS primary,
+        SSR_COMPONENT as instruction_format,
+        TO_CHAR(CLASS_NBR_1) as primary_associated_section_id,
+        TRIM(DISPLAY_NAME) AS display_name,
+        CLASS_SECTION AS section_num,
+        DISPLAY_NAME as course_display_name,
+        TRIM(CATALOG_NBR) AS catalog_id,
+        regexp_replace(trim(CATALOG_NBR), '[A-Za-z]') AS catalog_root,
+        REPLACE(SUBSTR(REPLACE(trim(CATALOG_NBR),regexp_replace(trim(CATALOG_NBR), '[A-Za-z]'),'|'),1,1),'|','') AS catalog_prefix,
+        SUBSTR(REPLACE(trim(CATALOG_NBR),regexp_replace(trim(CATALOG_NBR), '[A-Za-z]'),'|'),instr(REPLACE(trim(CATALOG_NBR),regexp_replace(trim(CATALOG_NBR), '[A-Za-z]'),'|'),'|')+1) AS catalog_suffix,
+        EFFDT AS course_updated_date,
+        CRSE_ID as course_id,
+        ENRL_TOT AS enrollment_count,
+        ENRL_CAP AS enroll_limit,
+        WAIT_CAP AS waitlist_limit,
+        START_DT AS start_date,
+        END_DT AS end_date,
+        CAMPUS_ID AS instructor_uid,
+        TRIM(
+            TRIM(NAME_PREFIX) || ' ' ||
+            TRIM(FIRST_NAME) || ' ' ||
+            TRIM(MIDDLE_NAME) || NVL2(TRIM(MIDDLE_NAME), ' ', '') ||
+            TRIM(LAST_NAME) || ' ' ||
+            TRIM(NAME_SUFFIX)
+        ) AS instructor_name,
+        INSTR_ROLE AS instructor_role_code,
+        DESCR AS location,
+        CASE WHEN MON = 'Y' THEN 'MO' END ||
+            CASE WHEN TUES = 'Y' THEN 'TU' END ||
+            CASE WHEN WED = 'Y' THEN 'WE' END ||
+            CASE WHEN THURS = 'Y' THEN 'TH' END ||
+            CASE WHEN FRI = 'Y' THEN 'FR' END ||
+            CASE WHEN SAT = 'Y' THEN 'SA' END ||
+            CASE WHEN SUN = 'Y' THEN 'SU' END
+        AS meeting_days,
+        TO_CHAR(MEETING_TIME_START,'HH24:MI') AS meeting_start_time,
+        TO_CHAR(MEETING_TIME_END,'HH24:MI') AS meeting_end_time,
+        START_DATE AS meeting_start_date,
+        END_DATE AS meeting_end_date,
+        TRIM(REPLACE(REPLACE(COURSE_TITLE_LONG, CHR(10)), CHR(13))) AS course_title,
+        COURSE_TITLE AS course_title_short,
+        INSTRUCTION_MODE AS instruction_mode
+    FROM SISEDO.BCOURSESV00_VW"""
+
+term_enrollments_select = """
+    SELECT DISTINCT
+        enroll."CLASS_SECTION_ID" AS section_id,
+        enroll."TERM_ID" AS term_id,
+        enroll."SESSION_ID" AS session_id,
+        enroll."CAMPUS_UID" AS ldap_uid,
+        enroll."STUDENT_ID" AS sis_id,
+        enroll."STDNT_ENRL_STATUS_CODE" AS enrollment_status,
+        enroll."WAITLISTPOSITION" AS waitlist_position,
+        enroll."UNITS_TAKEN" AS units,
+        enroll."GRADE_MARK" AS grade,
+        enroll."GRADE_POINTS" AS grade_points,
+        enroll."GRADING_BASIS_CODE" AS grading_basis,
+        enroll."GRADE_MARK_MID" AS grade_midterm,
+        enroll."INSTITUTION" AS institution
+    FROM SISEDO.ETS_ENROLLMENTV01_VW enroll"""
+
+
 def get_advisor_notes_access():
-    return """
+    sql = """
         SELECT
             A.USER_ID,
             A.CS_ID,
             A.PERMISSION_LIST
         FROM SYSADM.BOA_ADV_NOTES_ACCESS_VW A"""
+    return sql, {}
 
 
 # See http://www.oracle.com/technetwork/issue-archive/2006/06-sep/o56asktom-086197.html for explanation of
-# query batching with ROWNUM.
-def get_basic_attributes():
-    def _get_batch_basic_attributes(batch_number, batch_size):
-        mininum_row_exclusive = (batch_number * batch_size)
-        maximum_row_inclusive = mininum_row_exclusive + batch_size
-        return f"""
+# query batching with ROWNUM. Keyset batching instead seeks past the last ldap_uid of the previous batch, so that
+# later batches cost no more than the first. ROWNUM batches have no separate pass for null keys, and return no
+# statement for one.
+def get_basic_attributes(keyset=False):
+    def _get_batch_basic_attributes(batch_number, batch_size, last_row=None, null_keys=False):
+        if null_keys:
+            return None
+        sql = f"""
             SELECT ldap_uid, sid, first_name, last_name, email_address, affiliations, person_type, alternateid
                 FROM (SELECT /*+ FIRST_ROWS(n) */ attributes.*, ROWNUM rnum
-                    FROM (SELECT
-                        pi.ldap_uid, pi.student_id AS sid, TRIM(pi.first_name) AS first_name, TRIM(pi.last_name) as last_name,
-                        pi.email_address, pi.affiliations, pi.person_type, pi.alternateid
-                        FROM SISEDO.CALCENTRAL_PERSON_INFO_VW pi
-                        WHERE person_type != 'Z' AND affiliations IS NOT NULL
+                    FROM ({basic_attributes_select}
                         ORDER BY pi.ldap_uid
                     ) attributes
-                WHERE ROWNUM <= {maximum_row_inclusive})
-            WHERE rnum > {mininum_row_exclusive}"""
-    return _get_batch_basic_attributes
+                WHERE ROWNUM <= :maximum_row_inclusive)
+            WHERE rnum > :minimum_row_exclusive"""
+        return sql, _rownum_params(batch_number, batch_size)
+
+    def _get_keyset_batch_basic_attributes(batch_number, batch_size, last_row=None, null_keys=False):
+        seek_clause, params = _seek_clause(['pi.ldap_uid'], [last_row[0]] if last_row else None, null_keys)
+        sql = f"""{basic_attributes_select}
+            {seek_clause}
+            ORDER BY pi.ldap_uid
+            FETCH FIRST :batch_size ROWS WITH TIES"""
+        return sql, {**params, 'batch_size': batch_size}
+
+    return _get_keyset_batch_basic_attributes if keyset else _get_batch_basic_attributes
+
+
+# Chunked extracts split a dataset into key ranges of about equal size, bounded by the first key of each NTILE group,
+# and read the ranges concurrently. Rows with a null key sort last, and so fall in the final range.
+def get_basic_attributes_boundaries(chunk_count):
+    sql = f"""
+        SELECT MIN(ldap_uid) FROM (
+            SELECT attributes.ldap_uid, NTILE(:chunk_count) OVER (ORDER BY attributes.ldap_uid) AS chunk
+            FROM ({basic_attributes_select}) attributes
+            WHERE attributes.ldap_uid IS NOT NULL
+        )
+        GROUP BY chunk
+        ORDER BY 1"""
+    return sql, {'chunk_count': chunk_count}
+
+
+def get_basic_attributes_chunk(lower_bound, upper_bound):
+    range_clause, params = _range_clause('pi.ldap_uid', lower_bound, upper_bound)
+    sql = f"""{basic_attributes_select}
+        {range_clause}
+        ORDER BY pi.ldap_uid"""
+    return sql, params
 
 
 # Get the undergraduate term in progress, plus the next two. Ripley code on the other side of the pipeline will
 # validate how many of these should in fact be considered 'current.'
 def get_current_terms():
-    return """
+    sql = """
         SELECT * FROM (
             SELECT DISTINCT term_id FROM SISEDO.CLC_TERMV00_VW WHERE term_id >= (
                 SELECT MAX(term_id) from SISEDO.CLC_TERMV00_VW where term_id < (
@@ -65,10 +174,11 @@ def get_current_terms():
                 )
             ) ORDER BY term_id
         ) WHERE rownum <= 3"""
+    return sql, {}
 
 
 def get_instructor_advisor_relationships():
-    return """
+    sql = """
         SELECT DISTINCT
             I.ADVISOR_ID,
             I.CAMPUS_ID,
@@ -93,119 +203,82 @@ def get_instructor_advisor_relationships():
                 WHERE I1.ADVISOR_ID = I.ADVISOR_ID
                 AND I1.INSTRUCTOR_ADISOR_NUMBER = I.INSTRUCTOR_ADISOR_NUMBER
             )"""
+    return sql, {}
+
+# Multi-term statements cover several terms in one scan of the view, ordered by term, so that rows can be routed to
+# per-term outputs as they arrive. Within each term, rows come in the same order as from the per-term statement.
+def get_multi_term_courses(term_ids):
+    term_condition, params = _term_ids_condition(term_ids)
+    sql = f"""{term_courses_select}
+        WHERE STRM {term_condition}
+        ORDER BY STRM"""
+    return sql, params
+
+
+def get_multi_term_enrollments(term_ids, keyset=False):
+    term_condition, term_params = _term_ids_condition(term_ids)
+
+    def _get_batch_multi_term_enrollments(batch_number, batch_size, last_row=None, null_keys=False):
+        if null_keys:
+            return None
+        sql = f"""
+            SELECT section_id, term_id, session_id, ldap_uid, sis_id, enrollment_status, waitlist_position, units,
+                    grade, grade_points, grading_basis, grade_midterm, institution FROM (
+                SELECT /*+ FIRST_ROWS(n) */ enrollments.*, ROWNUM rnum FROM ({term_enrollments_select}
+                    WHERE enroll."TERM_ID" {term_condition}
+                    ORDER BY term_id, section_id, sis_id
+                ) enrollments
+                WHERE ROWNUM <= :maximum_row_inclusive
+            )
+            WHERE rnum > :minimum_row_exclusive"""
+        return sql, {**_rownum_params(batch_number, batch_size), **term_params}
+
+    def _get_keyset_batch_multi_term_enrollments(batch_number, batch_size, last_row=None, null_keys=False):
+        seek_clause, params = _seek_clause(
+            ['enroll."TERM_ID"', 'enroll."CLASS_SECTION_ID"', 'enroll."STUDENT_ID"'],
+            [last_row[1], last_row[0], last_row[4]] if last_row else None,
+            null_keys,
+        )
+        sql = f"""{term_enrollments_select}
+            WHERE enroll."TERM_ID" {term_condition}
+            {seek_clause}
+            ORDER BY term_id, section_id, sis_id
+            FETCH FIRST :batch_size ROWS WITH TIES"""
+        return sql, {**params, **term_params, 'batch_size': batch_size}
+
+    return _get_keyset_batch_multi_term_enrollments if keyset else _get_batch_multi_term_enrollments
+
+
+def get_multi_term_recent_enrollment_updates(term_ids, recency_cutoff):
+    term_condition, params = _term_ids_condition(term_ids)
+    sql = _get_recent_enrollment_updates_sql(term_condition)
+    return sql, {**params, 'recency_cutoff': recency_cutoff.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def get_multi_term_recent_instructor_updates(term_ids, recency_cutoff):
+    term_condition, params = _term_ids_condition(term_ids)
+    sql = _get_recent_instructor_updates_sql(term_condition)
+    return sql, {**params, 'recency_cutoff': recency_cutoff.strftime('%Y-%m-%d %H:%M:%S')}
+
 
 def get_recent_enrollment_updates(term_id, recency_cutoff):
-    return f"""
-        SELECT DISTINCT
-            enroll.CLASS_SECTION_ID as section_id,
-            enroll.TERM_ID as term_id,
-            enroll.CAMPUS_UID AS ldap_uid,
-            enroll.STUDENT_ID AS sis_id,
-            enroll.STDNT_ENRL_STATUS_CODE AS enroll_status,
-            enroll.COURSE_CAREER AS course_career,
-            enroll.LAST_UPDATED as last_updated
-        FROM SISEDO.ETS_ENROLLMENTV01_VW enroll
-        WHERE enroll.TERM_ID = {term_id}
-        AND {omit_drops_and_withdrawals}
-        AND enroll.last_updated >= to_timestamp('{recency_cutoff.strftime('%Y-%m-%d %H:%M:%S')}', 'yyyy-mm-dd hh24:mi:ss')
-        ORDER BY enroll.TERM_ID,
-            -- In case the number of results exceeds our processing cutoff, set priority within terms by the academic
-            -- career type for the course.
-            CASE
-                WHEN enroll.course_career = 'UGRD' THEN 1
-                WHEN enroll.course_career = 'GRAD' THEN 2
-                WHEN enroll.course_career = 'LAW' THEN 3
-                WHEN enroll.course_career = 'UCBX' THEN 4
-                ELSE 5
-            END,
-            enroll.CLASS_SECTION_ID, enroll.CAMPUS_UID, enroll.last_updated DESC"""
+    sql = _get_recent_enrollment_updates_sql('= :term_id')
+    return sql, _recent_updates_params(term_id, recency_cutoff)
 
 
 def get_recent_instructor_updates(term_id, recency_cutoff):
-    return f"""
-        SELECT DISTINCT
-            up.instr_id AS sis_id,
-            up.term_id,
-            up.class_section_id AS section_id,
-            up.crse_id AS course_id,
-            instr."campus-uid" AS ldap_uid,
-            instr."role-code" AS role_code,
-            sec."primary",
-            up.last_updated
-            FROM SISEDO.CLASS_INSTR_UPDATESV00_VW up
-            JOIN SISEDO.ASSIGNEDINSTRUCTORV00_VW instr ON (
-                instr."cs-course-id" = up.crse_id AND
-                instr."term-id" = up.term_id AND
-                instr."session-id" = up.session_code AND
-                instr."offeringNumber" = up.crse_offer_nbr AND
-                instr."number" = up.class_section
-            )
-            JOIN SISEDO.CLASSSECTIONALLV01_MVW sec ON (
-                sec."id" = up.class_section_id AND sec."term-id" = up.term_id
-            )
-            WHERE up.change_type IN ('C', 'U') AND up.term_id= {term_id} AND
-            up.last_updated >= to_timestamp('{recency_cutoff.strftime('%Y-%m-%d %H:%M:%S')}', 'yyyy-mm-dd hh24:mi:ss')
-            ORDER BY up.term_id, up.crse_id, up.class_section_id, instr."campus-uid", up.last_updated DESC"""
+    sql = _get_recent_instructor_updates_sql('= :term_id')
+    return sql, _recent_updates_params(term_id, recency_cutoff)
 
 
 def get_term_courses(term_id):
-    return f"""
-        SELECT DISTINCT
-            TO_CHAR(CLASS_NBR) AS section_id,
-            STRM AS term_id,
-            SESSION_CODE AS session_id,
-            SUBJECT AS dept_name,
-            SUBJECT AS dept_code,
-            ACAD_CAREER AS course_career_code,
-            SCHEDULE_PRINT AS print_in_schedule_of_classes,
-            CASE WHEN PRIMARY_FLAG = 'Y' THEN 'true' ELSE 'false' END AS primary,
-            SSR_COMPONENT as instruction_format,
-            TO_CHAR(CLASS_NBR_1) as primary_associated_section_id,
-            TRIM(DISPLAY_NAME) AS display_name,
-            CLASS_SECTION AS section_num,
-            DISPLAY_NAME as course_display_name,
-            TRIM(CATALOG_NBR) AS catalog_id,
-            regexp_replace(trim(CATALOG_NBR), '[A-Za-z]') AS catalog_root,
-            REPLACE(SUBSTR(REPLACE(trim(CATALOG_NBR),regexp_replace(trim(CATALOG_NBR), '[A-Za-z]'),'|'),1,1),'|','') AS catalog_prefix,
-            SUBSTR(REPLACE(trim(CATALOG_NBR),regexp_replace(trim(CATALOG_NBR), '[A-Za-z]'),'|'),instr(REPLACE(trim(CATALOG_NBR),regexp_replace(trim(CATALOG_NBR), '[A-Za-z]'),'|'),'|')+1) AS catalog_suffix,
-            EFFDT AS course_updated_date,
-            CRSE_ID as course_id,
-            ENRL_TOT AS enrollment_count,
-            ENRL_CAP AS enroll_limit,
-            WAIT_CAP AS waitlist_limit,
-            START_DT AS start_date,
-            END_DT AS end_date,
-            CAMPUS_ID AS instructor_uid,
-            TRIM(
-                TRIM(NAME_PREFIX) || ' ' ||
-                TRIM(FIRST_NAME) || ' ' ||
-                TRIM(MIDDLE_NAME) || NVL2(TRIM(MIDDLE_NAME), ' ', '') ||
-                TRIM(LAST_NAME) || ' ' ||
-                TRIM(NAME_SUFFIX)
-            ) AS instructor_name,
-            INSTR_ROLE AS instructor_role_code,
-            DESCR AS location,
-            CASE WHEN MON = 'Y' THEN 'MO' END ||
-                CASE WHEN TUES = 'Y' THEN 'TU' END ||
-                CASE WHEN WED = 'Y' THEN 'WE' END ||
-                CASE WHEN THURS = 'Y' THEN 'TH' END ||
-                CASE WHEN FRI = 'Y' THEN 'FR' END ||
-                CASE WHEN SAT = 'Y' THEN 'SA' END ||
-                CASE WHEN SUN = 'Y' THEN 'SU' END
-            AS meeting_days,
-            TO_CHAR(MEETING_TIME_START,'HH24:MI') AS meeting_start_time,
-            TO_CHAR(MEETING_TIME_END,'HH24:MI') AS meeting_end_time,
-            START_DATE AS meeting_start_date,
-            END_DATE AS meeting_end_date,
-            TRIM(REPLACE(REPLACE(COURSE_TITLE_LONG, CHR(10)), CHR(13))) AS course_title,
-            COURSE_TITLE AS course_title_short,
-            INSTRUCTION_MODE AS instruction_mode
-        FROM SISEDO.BCOURSESV00_VW
-        WHERE STRM = '{term_id}'"""
+    sql = f"""{term_courses_select}
+        WHERE STRM = :term_id"""
+    return sql, {'term_id': str(term_id)}
 
 
 def get_term_courses_deprecated(term_id):
-    return f"""
+    sql = """
         SELECT DISTINCT
             sec."id" AS section_id,
             sec."term-id" AS term_id,
@@ -263,7 +336,7 @@ def get_term_courses_deprecated(term_id):
             instr."offeringNumber" = sec."offeringNumber" AND
             instr."number" = sec."sectionNumber")
         WHERE
-            sec."term-id" = '{term_id}'
+            sec."term-id" = :term_id
             AND CAST(crs."fromDate" AS DATE) <= term1.TERM_END_DT
             AND CAST(crs."toDate" AS DATE) >= term1.TERM_END_DT
             AND crs."updatedDate" = (
@@ -281,35 +354,189 @@ def get_term_courses_deprecated(term_id):
                     OR CAST(crs2."updatedDate" AS DATE) = TO_DATE('1901-01-01', 'YYYY-MM-DD')
                 )
             )"""
+    return sql, {'term_id': str(term_id)}
+
+
+def get_term_enrollments_boundaries(term_id, chunk_count):
+    sql = f"""
+        SELECT MIN(section_id) FROM (
+            SELECT enrollments.section_id, NTILE(:chunk_count) OVER (ORDER BY enrollments.section_id) AS chunk
+            FROM ({term_enrollments_select}
+                WHERE enroll."TERM_ID" = :term_id
+            ) enrollments
+            WHERE enrollments.section_id IS NOT NULL
+        )
+        GROUP BY chunk
+        ORDER BY 1"""
+    return sql, {'chunk_count': chunk_count, 'term_id': str(term_id)}
+
 
+def get_term_enrollments_chunk(term_id, lower_bound, upper_bound):
+    range_clause, params = _range_clause('enroll."CLASS_SECTION_ID"', lower_bound, upper_bound)
+    sql = f"""{term_enrollments_select}
+        WHERE enroll."TERM_ID" = :term_id
+        {range_clause}
+        ORDER BY section_id, sis_id"""
+    return sql, {**params, 'term_id': str(term_id)}
 
-def get_term_enrollments(term_id):
-    def _get_batch_term_enrollments(batch_number, batch_size):
-        mininum_row_exclusive = (batch_number * batch_size)
-        maximum_row_inclusive = mininum_row_exclusive + batch_size
-        return f"""
+
+def get_term_enrollments(term_id, keyset=False):
+    def _get_batch_term_enrollments(batch_number, batch_size, last_row=None, null_keys=False):
+        if null_keys:
+            return None
+        sql = f"""
             SELECT section_id, term_id, session_id, ldap_uid, sis_id, enrollment_status, waitlist_position, units,
                     grade, grade_points, grading_basis, grade_midterm, institution FROM (
-                SELECT /*+ FIRST_ROWS(n) */ enrollments.*, ROWNUM rnum FROM (
-                    SELECT DISTINCT
-                        enroll."CLASS_SECTION_ID" AS section_id,
-                        enroll."TERM_ID" AS term_id,
-                        enroll."SESSION_ID" AS session_id,
-                        enroll."CAMPUS_UID" AS ldap_uid,
-                        enroll."STUDENT_ID" AS sis_id,
-                        enroll."STDNT_ENRL_STATUS_CODE" AS enrollment_status,
-                        enroll."WAITLISTPOSITION" AS waitlist_position,
-                        enroll."UNITS_TAKEN" AS units,
-                        enroll."GRADE_MARK" AS grade,
-                        enroll."GRADE_POINTS" AS grade_points,
-                        enroll."GRADING_BASIS_CODE" AS grading_basis,
-                        enroll."GRADE_MARK_MID" AS grade_midterm,
-                        enroll."INSTITUTION" AS institution
-                    FROM SISEDO.ETS_ENROLLMENTV01_VW enroll
-                    WHERE enroll."TERM_ID" = '{term_id}'
+                SELECT /*+ FIRST_ROWS(n) */ enrollments.*, ROWNUM rnum FROM ({term_enrollments_select}
+                    WHERE enroll."TERM_ID" = :term_id
                     ORDER BY section_id, sis_id
                 ) enrollments
-                WHERE ROWNUM <= {maximum_row_inclusive}
+                WHERE ROWNUM <= :maximum_row_inclusive
+            )
+            WHERE rnum > :minimum_row_exclusive"""
+        return sql, {**_rownum_params(batch_number, batch_size), 'term_id': str(term_id)}
+
+    def _get_keyset_batch_term_enrollments(batch_number, batch_size, last_row=None, null_keys=False):
+        seek_clause, params = _seek_clause(
+            ['enroll."CLASS_SECTION_ID"', 'enroll."STUDENT_ID"'],
+            [last_row[0], last_row[4]] if last_row else None,
+            null_keys,
+        )
+        sql = f"""{term_enrollments_select}
+            WHERE enroll."TERM_ID" = :term_id
+            {seek_clause}
+            ORDER BY section_id, sis_id
+            FETCH FIRST :batch_size ROWS WITH TIES"""
+        return sql, {**params, 'batch_size': batch_size, 'term_id': str(term_id)}
+
+    return _get_keyset_batch_term_enrollments if keyset else _get_batch_term_enrollments
+
+
+def _get_recent_enrollment_updates_sql(term_condition):
+    sql = f"""
+        SELECT DISTINCT
+            enroll.CLASS_SECTION_ID as section_id,
+            enroll.TERM_ID as term_id,
+            enroll.CAMPUS_UID AS ldap_uid,
+            enroll.STUDENT_ID AS sis_id,
+            enroll.STDNT_ENRL_STATUS_CODE AS enroll_status,
+            enroll.COURSE_CAREER AS course_career,
+            enroll.LAST_UPDATED as last_updated
+        FROM SISEDO.ETS_ENROLLMENTV01_VW enroll
+        WHERE enroll.TERM_ID {term_condition}
+        AND {omit_drops_and_withdrawals}
+        AND enroll.last_updated >= to_timestamp(:recency_cutoff, 'yyyy-mm-dd hh24:mi:ss')
+        ORDER BY enroll.TERM_ID,
+            -- In case the number of results exceeds our processing cutoff, set priority within terms by the academic
+            -- career type for the course.
+            CASE
+                WHEN enroll.course_career = 'UGRD' THEN 1
+                WHEN enroll.course_career = 'GRAD' THEN 2
+                WHEN enroll.course_career = 'LAW' THEN 3
+                WHEN enroll.course_career = 'UCBX' THEN 4
+                ELSE 5
+            END,
+            enroll.CLASS_SECTION_ID, enroll.CAMPUS_UID, enroll.last_updated DESC"""
+    return sql
+
+
+def _get_recent_instructor_updates_sql(term_condition):
+    sql = f"""
+        SELECT DISTINCT
+            up.instr_id AS sis_id,
+            up.term_id,
+            up.class_section_id AS section_id,
+            up.crse_id AS course_id,
+            instr."campus-uid" AS ldap_uid,
+            instr."role-code" AS role_code,
+            sec."primary",
+            up.last_updated
+            FROM SISEDO.CLASS_INSTR_UPDATESV00_VW up
+            JOIN SISEDO.ASSIGNEDINSTRUCTORV00_VW instr ON (
+                instr."cs-course-id" = up.crse_id AND
+                instr."term-id" = up.term_id AND
+                instr."session-id" = up.session_code AND
+                instr."offeringNumber" = up.crse_offer_nbr AND
+                instr."number" = up.class_section
             )
-            WHERE rnum > {mininum_row_exclusive}"""
-    return _get_batch_term_enrollments
+            JOIN SISEDO.CLASSSECTIONALLV01_MVW sec ON (
+                sec."id" = up.class_section_id AND sec."term-id" = up.term_id
+            )
+            WHERE up.change_type IN ('C', 'U') AND up.term_id {term_condition} AND
+            up.last_updated >= to_timestamp(:recency_cutoff, 'yyyy-mm-dd hh24:mi:ss')
+            ORDER BY up.term_id, up.crse_id, up.class_section_id, instr."campus-uid", up.last_updated DESC"""
+    return sql
+
+
+# Matches rows sorting strictly after the given key values under Oracle's default ascending NULLS LAST order. Null
+# key values are written into the SQL text rather than bound, so there are at most a handful of distinct statements.
+def _keyset_predicate(columns, values, params):
+    column, value = columns[0], values[0]
+    bind_name = f'key_{len(params)}'
+    if value is not None:
+        params[bind_name] = value
+    if len(columns) == 1:
+        return '1 = 0' if value is None else f'({column} > :{bind_name} OR {column} IS NULL)'
+    if value is None:
+        return f'({column} IS NULL AND {_keyset_predicate(columns[1:], values[1:], params)})'
+    rest = _keyset_predicate(columns[1:], values[1:], params)
+    return f'({column} > :{bind_name} OR {column} IS NULL OR ({column} = :{bind_name} AND {rest}))'
+
+
+def _range_clause(column, lower_bound, upper_bound):
+    params = {}
+    conditions = []
+    if lower_bound is not None:
+        params['lower_bound'] = lower_bound
+        conditions.append(f'{column} >= :lower_bound')
+    if upper_bound is not None:
+        params['upper_bound'] = upper_bound
+        conditions.append(f'{column} < :upper_bound')
+    if not conditions:
+        return '', params
+    # The last range has no upper bound, and takes the null keys as well.
+    if upper_bound is None:
+        return f'AND ({conditions[0]} OR {column} IS NULL)', params
+    return f"AND {' AND '.join(conditions)}", params
+
+
+def _recent_updates_params(term_id, recency_cutoff):
+    return {
+        'recency_cutoff': recency_cutoff.strftime('%Y-%m-%d %H:%M:%S'),
+        'term_id': str(term_id),
+    }
+
+
+def _rownum_params(batch_number, batch_size):
+    return {
+        'minimum_row_exclusive': batch_number * batch_size,
+        'maximum_row_inclusive': (batch_number + 1) * batch_size,
+    }
+
+
+# Keyset batches read rows with a non-null leading key first, seeking past the last row with a plain range predicate on
+# the leading column, so that each batch can be an index range scan however far into the extract it is. Rows with a
+# null leading key sort last, and are read in a final pass of their own.
+def _seek_clause(columns, values, null_keys=False):
+    params = {}
+    column = columns[0]
+    if null_keys:
+        predicate = f'{column} IS NULL'
+        if values:
+            rest = _keyset_predicate(columns[1:], values[1:], params) if len(columns) > 1 else '1 = 0'
+            predicate = f'{predicate} AND {rest}'
+    elif values:
+        bind_name = f'key_{len(params)}'
+        params[bind_name] = values[0]
+        predicate = f'{column} > :{bind_name}'
+        if len(columns) > 1:
+            rest = _keyset_predicate(columns[1:], values[1:], params)
+            predicate = f'{column} >= :{bind_name} AND ({predicate} OR {rest})'
+    else:
+        predicate = f'{column} IS NOT NULL'
+    return f'AND {predicate}', params
+
+
+def _term_ids_condition(term_ids):
+    params = {f'term_{idx}': str(term_id) for idx, term_id in enumerate(term_ids)}
+    return f"IN ({', '.join(f':{name}' for name in params)})", params
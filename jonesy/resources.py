@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+import threading
+
+import boto3
+from botocore.credentials import DeferredRefreshableCredentials
+from botocore.session import get_session as get_botocore_session
+import oracledb
+
+
+class Resources:
+
+    # Holds the SISEDO connection pool, S3 client and STS credentials for the length of a job run, so that connect
+    # and auth latency is paid once rather than once per extract.
+    def __init__(self, config):
+        self.config = config
+        self.client = None
+        self.lock = threading.Lock()
+        self.pool = None
+        self.counts = {
+            'oracle_logins': 0,
+            'oracle_acquisitions': 0,
+            's3_clients': 0,
+            'sts_assume_role_calls': 0,
+        }
+
+    def close(self):
+        with self.lock:
+            if self.pool:
+                self.pool.close(force=True)
+                self.pool = None
+            self.client = None
+
+    def get_client(self):
+        with self.lock:
+            if not self.client:
+                session = self._get_session()
+                self.client = session.client('s3', region_name=self.config['AWS_REGION'])
+                self.counts['s3_clients'] += 1
+            return self.client
+
+    def get_counts(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def get_pool(self):
+        with self.lock:
+            if not self.pool:
+                self.pool = oracledb.create_pool(
+                    user=self.config['SISEDO_UN'],
+                    password=self.config['SISEDO_PW'],
+                    host=self.config['SISEDO_HOST'],
+                    port=self.config['SISEDO_PORT'],
+                    sid=self.config['SISEDO_SID'],
+                    min=1,
+                    max=int(self.config.get('SISEDO_POOL_MAX', self.config.get('JOB_PARALLELISM', 2))),
+                    increment=1,
+                    session_callback=self._on_new_session,
+                    stmtcachesize=int(self.config.get('SISEDO_STMT_CACHE_SIZE', 40)),
+                )
+            return self.pool
+
+    # Resources may outlive a job run, as under the scheduler, so usage is logged as the change since counts_at_start.
+    def log_counts(self, job_name, counts_at_start=None):
+        counts_at_start = counts_at_start or {}
+        counts = ', '.join(f'{k}={v - counts_at_start.get(k, 0)}' for k, v in self.get_counts().items())
+        print(f'Job {job_name} resource usage: {counts}')
+
+    @contextmanager
+    def sisedo_connection(self):
+        with self.get_pool().acquire() as connection:
+            with self.lock:
+                self.counts['oracle_acquisitions'] += 1
+            with connection.cursor() as cursor:
+                cursor.arraysize = int(self.config.get('SISEDO_ARRAYSIZE', 5000))
+                cursor.prefetchrows = int(self.config.get('SISEDO_PREFETCHROWS', 5000))
+                yield cursor
+
+    # Assumed-role credentials are fetched on first use and renewed by botocore shortly before they expire, so that a
+    # client held across a long multipart upload, or across scheduled runs, never signs a request with expired keys.
+    def _get_session(self):
+        if self.config['AWS_ROLE_ARN']:
+            botocore_session = get_botocore_session()
+            botocore_session._credentials = DeferredRefreshableCredentials(
+                refresh_using=self._get_sts_credentials,
+                method='sts-assume-role',
+            )
+            return boto3.Session(botocore_session=botocore_session)
+        else:
+            return boto3.Session(
+                aws_access_key_id=self.config['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=self.config['AWS_SECRET_ACCESS_KEY'],
+            )
+
+    def _get_sts_credentials(self):
+        sts_client = boto3.client('sts')
+        assumed_role_object = sts_client.assume_role(
+            RoleArn=self.config['AWS_ROLE_ARN'],
+            RoleSessionName='AssumeAppRoleSession',
+            DurationSeconds=3600,
+        )
+        with self.lock:
+            self.counts['sts_assume_role_calls'] += 1
+        credentials = assumed_role_object['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    def _on_new_session(self, connection, requested_tag):
+        with self.lock:
+            self.counts['oracle_logins'] += 1
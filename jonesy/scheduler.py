@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+import json
+import os
+import re
+import signal
+import threading
+import traceback
+
+from jonesy.files import replace_file
+from jonesy.jobs import Job
+from jonesy.resources import Resources
+
+
+JOB_NAMES = ['upload_advisors', 'upload_snapshot', 'upload_recent_refresh']
+INTERVAL_PATTERN = re.compile(r'^(\d+)m$')
+TIME_OF_DAY_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+class Schedule:
+
+    # A schedule is either an interval in minutes, such as '10m', or a comma-separated list of local times of day,
+    # such as '04:30,16:30'. Interval schedules run as soon as the scheduler starts, and then that long after each
+    # run starts.
+    def __init__(self, spec):
+        self.spec = spec
+        self.interval = None
+        self.times = []
+        match = INTERVAL_PATTERN.match(spec)
+        if match:
+            self.interval = timedelta(minutes=int(match.group(1)))
+        else:
+            for time_of_day in spec.split(','):
+                match = TIME_OF_DAY_PATTERN.match(time_of_day.strip())
+                if not match:
+                    raise ValueError(f'Invalid schedule: {spec}')
+                self.times.append((int(match.group(1)), int(match.group(2))))
+        if self.interval == timedelta(0):
+            raise ValueError(f'Invalid schedule: {spec}')
+
+    def get_next_run(self, now, last_started_at=None):
+        if self.interval:
+            return last_started_at + self.interval if last_started_at else now
+        candidates = []
+        for hour, minute in self.times:
+            candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if candidate <= now:
+                candidate += timedelta(days=1)
+            candidates.append(candidate)
+        return min(candidates)
+
+
+class Scheduler:
+
+    # Runs jobs on their SCHEDULE_<JOB> schedules within one long-lived process. Jobs share one Resources, so the
+    # SISEDO pool, S3 client and STS credentials stay warm between runs. Each job runs on a thread of its own; a job
+    # that comes due while its previous run is still going is skipped until its next due time, and different jobs may
+    # run at once. The state of every scheduled job is written to SCHEDULER_STATUS_PATH after each start and finish.
+    def __init__(self, config, resources=None):
+        self.config = config
+        self.resources = resources or Resources(config)
+        self.lock = threading.Lock()
+        self.poll_seconds = float(config.get('SCHEDULER_POLL_SECONDS', 5))
+        self.status_path = config.get('SCHEDULER_STATUS_PATH', 'log/scheduler-status.json')
+        self.stopping = threading.Event()
+        self.threads = {}
+        self.schedules = {}
+        self.status = {}
+        now = datetime.now()
+        for name in JOB_NAMES:
+            spec = config.get(f'SCHEDULE_{name.upper()}')
+            if not spec:
+                continue
+            self.schedules[name] = Schedule(spec)
+            self.status[name] = {
+                'schedule': spec,
+                'running': False,
+                'next_run_at': self.schedules[name].get_next_run(now),
+                'last_started_at': None,
+                'last_finished_at': None,
+                'last_success': None,
+                'last_seconds': None,
+                'runs': 0,
+                'failures': 0,
+                'skipped': 0,
+            }
+
+    def run(self):
+        if not self.schedules:
+            print('No job schedules configured, aborting')
+            return False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        schedules = ', '.join(f'{name}={schedule.spec}' for name, schedule in self.schedules.items())
+        print(f'Scheduler started: {schedules}')
+        self._write_status()
+        try:
+            while not self.stopping.is_set():
+                self._start_due_jobs(datetime.now())
+                self.stopping.wait(self.poll_seconds)
+        finally:
+            print('Scheduler stopping, waiting for running jobs')
+            with self.lock:
+                threads = list(self.threads.values())
+            for thread in threads:
+                thread.join()
+            self.resources.close()
+            self._write_status()
+            print('Scheduler stopped')
+        return True
+
+    def stop(self, signum=None, frame=None):
+        self.stopping.set()
+
+    def _run_job(self, name):
+        started_at = datetime.now()
+        success = False
+        try:
+            success = Job(name, self.config, self.resources).run()
+        except Exception as e:
+            traceback.print_exception(e)
+        finally:
+            finished_at = datetime.now()
+            with self.lock:
+                status = self.status[name]
+                status['running'] = False
+                status['last_finished_at'] = finished_at
+                status['last_success'] = success
+                status['last_seconds'] = round((finished_at - started_at).total_seconds(), 3)
+                if not success:
+                    status['failures'] += 1
+                del self.threads[name]
+            self._write_status()
+
+    def _start_due_jobs(self, now):
+        started = False
+        with self.lock:
+            for name, schedule in self.schedules.items():
+                status = self.status[name]
+                if status['next_run_at'] > now:
+                    continue
+                if status['running']:
+                    print(f'Job {name} is due but its previous run is still going, skipping')
+                    status['skipped'] += 1
+                    status['next_run_at'] = schedule.get_next_run(now, now)
+                    continue
+                status['running'] = True
+                status['last_started_at'] = now
+                status['runs'] += 1
+                status['next_run_at'] = schedule.get_next_run(now, now)
+                self.threads[name] = threading.Thread(target=self._run_job, args=(name,), name=f'scheduler-{name}')
+                self.threads[name].start()
+                started = True
+        if started:
+            self._write_status()
+
+    def _write_status(self):
+        if not self.status_path:
+            return
+        with self.lock:
+            status = {
+                'updated_at': datetime.now().isoformat(),
+                'pid': os.getpid(),
+                'stopping': self.stopping.is_set(),
+                'jobs': {name: {k: _format_status_value(v) for k, v in s.items()} for name, s in self.status.items()},
+            }
+            os.makedirs(os.path.dirname(self.status_path) or '.', exist_ok=True)
+            replace_file(self.status_path, json.dumps(status, indent=2))
+
+
+def _format_status_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
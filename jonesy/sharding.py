@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import threading
+
+
+class ShardedWriter:
+
+    # Writes CSV text as a series of part files under a key prefix, each compressed on its own so that a loader can
+    # read the parts in parallel. A part is finished at the first batch boundary after it reaches max_rows rows or
+    # max_bytes bytes of CSV, and then completes its upload on a background thread while the next part fills. At most
+    # parallelism parts are completing at once. Parts already uploaded by a failed extract are left in place; the
+    # manifest written after the last part is what makes a set of parts complete.
+    def __init__(self, open_stream, codec, prefix, max_rows=0, max_bytes=0, parallelism=4, metrics=None):
+        self.open_stream = open_stream
+        self.codec = codec
+        self.prefix = prefix
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.compressed = None
+        self.executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='shard-upload')
+        self.futures = []
+        self.future_streams = []
+        self.outfile = None
+        self.part_rows = 0
+        self.part_slots = threading.BoundedSemaphore(parallelism)
+        self.parts = []
+        self.stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    # Parts already completing are waited for. Parts still waiting for a worker are cancelled, and their streams
+    # aborted here, since nothing else will close them.
+    def abort(self):
+        if self.stream:
+            self.stream.abort()
+            self.stream = None
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for future, stream in zip(self.futures, self.future_streams):
+            if future.cancelled():
+                stream.abort()
+
+    def close(self):
+        # A result set with no rows still gets one, empty, part.
+        if self.stream or not self.parts:
+            self._finish_part()
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.executor.shutdown(wait=True)
+        self.parts.sort(key=lambda p: p['key'])
+
+    def end_batch(self, row_count):
+        self.part_rows += row_count
+        if self.max_rows and self.part_rows >= self.max_rows:
+            self._finish_part()
+        elif self.max_bytes and self.stream and self.compressed.raw_size >= self.max_bytes:
+            self._finish_part()
+
+    def write(self, text):
+        if not self.stream:
+            self._start_part()
+        return self.outfile.write(text)
+
+    def _complete_part(self, stream, part):
+        try:
+            stream.close()
+            part['compressed_bytes'] = stream.bytes_written
+            self.parts.append(part)
+        finally:
+            self.part_slots.release()
+
+    def _finish_part(self):
+        if not self.stream:
+            self._start_part()
+        self.outfile.close()
+        part = {
+            'key': self.stream.key,
+            'rows': self.part_rows,
+            'raw_bytes': self.compressed.raw_size,
+            'sha256': self.compressed.sha256.hexdigest(),
+        }
+        # Blocks while parallelism parts are already completing, which applies backpressure to the writer.
+        self.part_slots.acquire()
+        self.futures.append(self.executor.submit(self._complete_part, self.stream, part))
+        self.future_streams.append(self.stream)
+        self.stream = None
+        self.part_rows = 0
+
+    def _start_part(self):
+        for future in self.futures:
+            if future.done() and future.exception():
+                raise future.exception()
+        self.stream = self.open_stream(f'{self.prefix}/part-{len(self.futures):05d}{self.codec.extension}')
+        self.compressed = self.codec.open(self.stream, self.metrics)
+        self.outfile = io.TextIOWrapper(self.compressed, encoding='utf-8', newline='\n')
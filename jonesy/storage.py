@@ -0,0 +1,257 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import re
+import threading
+
+from botocore.exceptions import ClientError as BotoClientError, ConnectionError as BotoConnectionError
+from jonesy.metrics import timed
+
+
+DAILY_PATH_PATTERN = re.compile(r'daily/[0-9a-f]{32}-\d{4}-\d{2}-\d{2}/')
+# S3 rejects multipart parts smaller than 5 MB, other than the last.
+MINIMUM_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3UploadError(Exception):
+    pass
+
+
+class S3UploadStream(io.RawIOBase):
+
+    # Bytes written to the stream are buffered until a full part is available, then sent on a background thread while
+    # the caller goes on writing. At most max_pending_parts parts are in flight at once, so memory use is bounded by
+    # roughly part_size * (max_pending_parts + 1). Objects smaller than a single part are sent with one put_object on
+    # close, or not at all if discard() is called first.
+    #
+    # A resumable stream only sends parts when flush_part() is called, so that the caller can line part boundaries up
+    # with its own checkpoints, and leaves the multipart upload open on failure so that a later run can pass its
+    # upload_id and parts back in and carry on. flush_part() doesn't wait for the part; its on_uploaded callback is
+    # called, on the upload thread, once that part and every part before it have been acknowledged.
+    def __init__(self, client, bucket, key, part_size=16 * 1024 * 1024, max_pending_parts=2, resumable=False,
+                 upload_id=None, parts=None, bytes_written=0, metrics=None):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.metrics = metrics
+        self.part_size = max(part_size, MINIMUM_PART_SIZE)
+        self.resumable = resumable
+        self.buffer = bytearray()
+        self.bytes_written = bytes_written
+        self.error = None
+        self.executor = ThreadPoolExecutor(max_workers=max_pending_parts, thread_name_prefix='s3-upload')
+        self.futures = []
+        self.part_slots = threading.BoundedSemaphore(max_pending_parts)
+        self.lock = threading.Lock()
+        self.on_uploaded = {}
+        self.parts = list(parts or [])
+        self.part_count = len(self.parts)
+        self.uploaded_part_count = len(self.parts)
+        self.upload_id = upload_id
+
+    # Only an explicit close() publishes the object. A stream dropped without close() or abort(), as when an exception
+    # unwinds past it, is aborted instead of being closed by io's finalizer. Finalization may run on any thread,
+    # including one of the stream's own upload threads, so it doesn't wait for parts in flight.
+    def __del__(self):
+        if not self.closed:
+            self.abort(wait=False)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def abort(self, wait=True):
+        if self.closed:
+            return
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        if self.upload_id and self.resumable:
+            print(f'S3 multipart upload left open for resume: bucket={self.bucket}, key={self.key}')
+        elif self.upload_id:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+                print(f'S3 multipart upload aborted: bucket={self.bucket}, key={self.key}')
+            except (BotoClientError, BotoConnectionError) as e:
+                print(f'Error on S3 multipart abort: bucket={self.bucket}, key={self.key}, error={e}')
+        super().close()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            with timed(self.metrics, 'upload'):
+                if self.upload_id:
+                    if self.buffer:
+                        self._submit_part(bytes(self.buffer))
+                    self._wait_for_parts()
+                    self._call(
+                        self.client.complete_multipart_upload,
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        UploadId=self.upload_id,
+                        MultipartUpload={'Parts': sorted(self.parts, key=lambda p: p['PartNumber'])},
+                    )
+                else:
+                    self._call(
+                        self.client.put_object,
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        Body=bytes(self.buffer),
+                        ServerSideEncryption='AES256',
+                    )
+        except S3UploadError:
+            self.abort()
+            raise
+        self.executor.shutdown(wait=True)
+        self.buffer = bytearray()
+        super().close()
+
+    def discard(self):
+        if self.upload_id:
+            raise S3UploadError(f'bucket={self.bucket}, error=parts already uploaded for {self.key}')
+        self.buffer = bytearray()
+        self.executor.shutdown(wait=True)
+        super().close()
+
+    def flush_part(self, on_uploaded=None):
+        if self.error:
+            raise S3UploadError(self.error)
+        with timed(self.metrics, 'upload'):
+            if self.buffer:
+                self._submit_part(bytes(self.buffer), on_uploaded)
+                self.buffer = bytearray()
+
+    @property
+    def multipart(self):
+        return self.upload_id is not None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error:
+            raise S3UploadError(self.error)
+        with timed(self.metrics, 'upload'):
+            self.buffer += data
+            self.bytes_written += len(data)
+            while len(self.buffer) >= self.part_size and not self.resumable:
+                part = bytes(self.buffer[:self.part_size])
+                del self.buffer[:self.part_size]
+                self._submit_part(part)
+        return len(data)
+
+    def _call(self, method, **kwargs):
+        try:
+            return method(**kwargs)
+        except (BotoClientError, BotoConnectionError, ValueError) as e:
+            raise S3UploadError(f'bucket={self.bucket}, error={e}')
+
+    def _submit_part(self, data, on_uploaded=None):
+        if not self.upload_id:
+            response = self._call(
+                self.client.create_multipart_upload,
+                Bucket=self.bucket,
+                Key=self.key,
+                ServerSideEncryption='AES256',
+            )
+            self.upload_id = response['UploadId']
+        self.part_count += 1
+        part_number = self.part_count
+        if on_uploaded:
+            self.on_uploaded[part_number] = on_uploaded
+        # Blocks while max_pending_parts uploads are already in flight, which applies backpressure to the writer.
+        self.part_slots.acquire()
+        self.futures.append(self.executor.submit(self._upload_part, part_number, data))
+
+    def _upload_part(self, part_number, data):
+        try:
+            with timed(self.metrics, 'upload_parts'):
+                response = self._call(
+                    self.client.upload_part,
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                )
+            with self.lock:
+                self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+                self._report_uploaded_parts()
+        except S3UploadError as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.part_slots.release()
+
+    # Parts may be acknowledged out of order, so callbacks are called in part order, for the longest run of parts from
+    # the first that have all been acknowledged.
+    def _report_uploaded_parts(self):
+        part_numbers = {p['PartNumber'] for p in self.parts}
+        while self.uploaded_part_count + 1 in part_numbers:
+            self.uploaded_part_count += 1
+            on_uploaded = self.on_uploaded.pop(self.uploaded_part_count, None)
+            if on_uploaded:
+                parts = sorted(self.parts, key=lambda p: p['PartNumber'])
+                on_uploaded(parts[:self.uploaded_part_count])
+
+    def _wait_for_parts(self):
+        for future in self.futures:
+            future.result()
+
+
+# Server-side copy, which S3 performs as a multipart copy for large objects. No data passes through this host.
+def copy_object(client, source_bucket, source_key, bucket, key):
+    try:
+        client.copy(
+            CopySource={'Bucket': source_bucket, 'Key': source_key},
+            Bucket=bucket,
+            Key=key,
+            ExtraArgs={'ServerSideEncryption': 'AES256'},
+        )
+    except (BotoClientError, BotoConnectionError, ValueError) as e:
+        raise S3UploadError(f'bucket={bucket}, copy_source={source_bucket}/{source_key}, error={e}')
+
+
+def get_manifest(client, bucket, manifest_key):
+    try:
+        response = client.get_object(Bucket=bucket, Key=manifest_key)
+        return json.loads(response['Body'].read())
+    except (BotoClientError, BotoConnectionError, ValueError):
+        return None
+
+
+# Each dataset's manifest lives at a fixed key outside the daily path, so that today's run can find the digest of the
+# most recent upload of the same dataset. For example, sis-data/daily/<digest>-<date>/courses/courses-2248.gz has
+# its manifest at sis-data/manifests/courses/courses-2248.gz.json.
+def get_manifest_key(s3_key):
+    return DAILY_PATH_PATTERN.sub('manifests/', s3_key) + '.json'
+
+
+def get_object_size(client, bucket, key):
+    try:
+        return client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    except (BotoClientError, BotoConnectionError):
+        return None
+
+
+def multipart_upload_exists(client, bucket, key, upload_id):
+    try:
+        client.list_parts(Bucket=bucket, Key=key, UploadId=upload_id, MaxParts=1)
+        return True
+    except (BotoClientError, BotoConnectionError):
+        return False
+
+
+def put_manifest(client, bucket, manifest_key, manifest):
+    try:
+        client.put_object(
+            Bucket=bucket,
+            Key=manifest_key,
+            Body=json.dumps(manifest, indent=2).encode(),
+            ContentType='application/json',
+            ServerSideEncryption='AES256',
+        )
+    except (BotoClientError, BotoConnectionError, ValueError) as e:
+        raise S3UploadError(f'bucket={bucket}, key={manifest_key}, error={e}')
@@ -0,0 +1,69 @@
+from datetime import datetime
+import json
+import os
+import threading
+
+from botocore.exceptions import ClientError as BotoClientError, ConnectionError as BotoConnectionError
+from jonesy.files import replace_file
+
+
+class WatermarkStore:
+
+    # High-water marks are the greatest last_updated value shipped per dataset and term, kept as a small JSON document
+    # either on local disk or as an object in the first target bucket. The document is rewritten after every
+    # successful extract, so a failed run leaves its datasets' marks where they were.
+    def __init__(self, config, resources):
+        self.config = config
+        self.resources = resources
+        self.lock = threading.Lock()
+        self.location = config.get('WATERMARK_STORE', 'local')
+        if self.location == 's3':
+            self.bucket = config['TARGETS'].split(',')[0]
+            self.key = config.get('WATERMARK_S3_KEY', 'sis-data/watermarks/recent-refresh.json')
+        else:
+            self.path = config.get('WATERMARK_PATH', 'log/watermarks.json')
+        self.watermarks = self._load()
+
+    def get(self, dataset, term_id):
+        value = self.watermarks.get(f'{dataset}-{term_id}')
+        return datetime.fromisoformat(value) if value else None
+
+    def set(self, dataset, term_id, value):
+        with self.lock:
+            previous = self.get(dataset, term_id)
+            if previous and previous >= value:
+                return
+            self.watermarks[f'{dataset}-{term_id}'] = value.isoformat()
+            self._save()
+        print(f'Watermark updated: dataset={dataset}, term_id={term_id}, last_updated={value.isoformat()}')
+
+    def _load(self):
+        if self.location == 's3':
+            try:
+                response = self.resources.get_client().get_object(Bucket=self.bucket, Key=self.key)
+                return json.loads(response['Body'].read())
+            except BotoClientError as e:
+                if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                    return {}
+                raise
+        elif os.path.exists(self.path):
+            with open(self.path) as f:
+                return json.load(f)
+        else:
+            return {}
+
+    def _save(self):
+        body = json.dumps(self.watermarks, indent=2, sort_keys=True)
+        if self.location == 's3':
+            try:
+                self.resources.get_client().put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=body.encode(),
+                    ContentType='application/json',
+                    ServerSideEncryption='AES256',
+                )
+            except (BotoClientError, BotoConnectionError) as e:
+                print(f'Error on watermark save: bucket={self.bucket}, key={self.key}, error={e}')
+        else:
+            replace_file(self.path, body)
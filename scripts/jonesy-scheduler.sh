@@ -0,0 +1,28 @@
+#!/bin/bash
+# Script to run Jonesy as a long-lived service, starting jobs on their SCHEDULE_<JOB> schedules. Jobs with a schedule
+# should be removed from cron.
+
+# Make sure the normal shell environment is in place, since it may not be
+# when running under a process supervisor.
+source "$HOME/.bash_profile"
+
+cd $( dirname "${BASH_SOURCE[0]}" )/..
+
+# The scheduler runs for days at a time, so each line is appended to the log named for the date it is written.
+function logit {
+    while IFS= read -r line; do
+        printf -v log "$PWD/log/jonesy_scheduler_%(%Y-%m-%d)T.log" -1
+        echo "$line"
+        echo "$line" >> "$log"
+    done
+}
+LOGIT=logit
+
+# Set Python environment
+pyenv activate venv_jonesy
+
+echo | $LOGIT
+echo "------------------------------------------" | $LOGIT
+echo "`date`: About to start the Jonesy scheduler..." | $LOGIT
+
+JOB=scheduler python -u jonesy.py |& $LOGIT
@@ -0,0 +1,105 @@
+import random
+import sqlite3
+
+from jonesy import jobs, queries
+
+
+TERM_ENROLLMENT_KEYS = ['enroll."CLASS_SECTION_ID"', 'enroll."STUDENT_ID"']
+
+
+def test_seek_clause_first_batch_skips_null_keys():
+    assert queries._seek_clause(['pi.ldap_uid'], None) == ('AND pi.ldap_uid IS NOT NULL', {})
+    assert queries._seek_clause(TERM_ENROLLMENT_KEYS, None) == ('AND enroll."CLASS_SECTION_ID" IS NOT NULL', {})
+
+
+def test_seek_clause_single_column():
+    clause, params = queries._seek_clause(['pi.ldap_uid'], ['1022'])
+    assert clause == 'AND pi.ldap_uid > :key_0'
+    assert params == {'key_0': '1022'}
+
+
+# The leading column gets a plain range predicate, with no IS NULL branch, so that Oracle can range scan its index.
+def test_seek_clause_composite_key():
+    clause, params = queries._seek_clause(TERM_ENROLLMENT_KEYS, [31555, '3030'])
+    assert clause == (
+        'AND enroll."CLASS_SECTION_ID" >= :key_0 AND (enroll."CLASS_SECTION_ID" > :key_0 OR '
+        '(enroll."STUDENT_ID" > :key_1 OR enroll."STUDENT_ID" IS NULL))'
+    )
+    assert params == {'key_0': 31555, 'key_1': '3030'}
+
+
+def test_seek_clause_composite_key_null_tie_breaker():
+    clause, params = queries._seek_clause(TERM_ENROLLMENT_KEYS, [31555, None])
+    assert clause == 'AND enroll."CLASS_SECTION_ID" >= :key_0 AND (enroll."CLASS_SECTION_ID" > :key_0 OR 1 = 0)'
+    assert params == {'key_0': 31555}
+
+
+def test_seek_clause_three_columns():
+    columns = ['enroll."TERM_ID"', 'enroll."CLASS_SECTION_ID"', 'enroll."STUDENT_ID"']
+    clause, params = queries._seek_clause(columns, ['2248', None, '3030'])
+    assert clause == (
+        'AND enroll."TERM_ID" >= :key_0 AND (enroll."TERM_ID" > :key_0 OR '
+        '(enroll."CLASS_SECTION_ID" IS NULL AND (enroll."STUDENT_ID" > :key_1 OR enroll."STUDENT_ID" IS NULL)))'
+    )
+    assert params == {'key_0': '2248', 'key_1': '3030'}
+
+
+def test_seek_clause_null_key_pass():
+    assert queries._seek_clause(['pi.ldap_uid'], None, null_keys=True) == ('AND pi.ldap_uid IS NULL', {})
+    assert queries._seek_clause(['pi.ldap_uid'], [None], null_keys=True) == ('AND pi.ldap_uid IS NULL AND 1 = 0', {})
+    clause, params = queries._seek_clause(TERM_ENROLLMENT_KEYS, [None, '3030'], null_keys=True)
+    assert clause == (
+        'AND enroll."CLASS_SECTION_ID" IS NULL AND (enroll."STUDENT_ID" > :key_0 OR enroll."STUDENT_ID" IS NULL)'
+    )
+    assert params == {'key_0': '3030'}
+
+
+def test_keyset_batch_query_binds():
+    sql, params = queries.get_term_enrollments(2248, keyset=True)(3, 500, [31555, '2248', '1', '1022', '3030'])
+    assert 'enroll."CLASS_SECTION_ID" >= :key_0' in sql
+    assert 'FETCH FIRST :batch_size ROWS WITH TIES' in sql
+    assert params == {'key_0': 31555, 'key_1': '3030', 'batch_size': 500, 'term_id': '2248'}
+
+
+def test_rownum_batch_query_has_no_null_key_pass():
+    assert queries.get_term_enrollments(2248)(3, 500, None, null_keys=True) is None
+    assert queries.get_basic_attributes()(3, 500, None, null_keys=True) is None
+
+
+# Runs keyset batches, both passes, against SQLite, which orders nulls the same way when asked, and checks that every
+# row is read once and in order, with null values in both key columns.
+def test_keyset_batches_read_every_row(monkeypatch):
+    monkeypatch.setattr(jobs, 'BATCH_SIZE', 7)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE enroll (section_id INTEGER, sis_id TEXT)')
+    sections = [None] + list(range(20))
+    sis_ids = [None] + [f'{i:05d}' for i in range(30)]
+    rng = random.Random(2248)
+    db.executemany(
+        'INSERT INTO enroll VALUES (?, ?)',
+        {(rng.choice(sections), rng.choice(sis_ids)) for _ in range(200)},
+    )
+
+    def _batch_query(batch_number, batch_size, last_row=None, null_keys=False):
+        seek_clause, params = queries._seek_clause(['section_id', 'sis_id'], last_row, null_keys)
+        sql = f"""SELECT section_id, sis_id FROM enroll WHERE 1 = 1 {seek_clause}
+            ORDER BY section_id NULLS LAST, sis_id NULLS LAST LIMIT :batch_size"""
+        return sql, {**params, 'batch_size': batch_size}
+
+    rows = [r for batch in jobs._fetch_batched_query(_SQLiteCursor(db), _batch_query) for r in batch]
+    expected = db.execute('SELECT section_id, sis_id FROM enroll ORDER BY section_id NULLS LAST, sis_id NULLS LAST')
+    assert rows == expected.fetchall()
+
+
+class _SQLiteCursor:
+
+    def __init__(self, db):
+        self.cursor = db.cursor()
+        self.rows = []
+
+    def execute(self, sql, params):
+        self.rows = self.cursor.execute(sql, params).fetchall()
+
+    def fetchmany(self):
+        rows, self.rows = self.rows[:3], self.rows[3:]
+        return rows